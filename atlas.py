@@ -0,0 +1,212 @@
+"""
+This module packs the colorkeyed images of main.IMAGE_MANIFEST, already
+scaled, into one atlas image with an index of where each one is. At startup
+the game then reads and decodes a single file instead of one per image, and
+cuts every image out of the atlas (see main.preload_images). The decoded
+atlas is kept in the image cache of imagecache.py like the other images.
+
+    python atlas.py    # Build img/atlas.png and img/atlas.json
+
+If the atlas is missing, older than any of its images or not made of the
+images of the manifest, the game builds it at startup and saves it for the
+next time. Images without colorkey, like
+the backgrounds, are left out and loaded on their own.
+"""
+import io
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import pygame
+import imagecache
+import main
+
+
+# Color of the transparent parts of the atlas, which no image may use
+KEY_COLOR = (255, 0, 255)
+MAX_WIDTH = 1024  # Width of the atlas, images are placed in rows up to it
+PADDING = 1  # Pixels between images
+
+
+def pack(sizes: List[Tuple[int, int]], max_width: int = MAX_WIDTH,
+         padding: int = PADDING) -> Tuple[List[pygame.Rect], Tuple[int, int]]:
+    """
+    Place rects of 'sizes' in rows, tallest first. Return the rect of each
+    size in the same order and the size of the whole atlas.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    rects = [None] * len(sizes)
+    x = y = row_height = width = 0
+    for i in order:
+        w, h = sizes[i]
+        if w > max_width:
+            raise ValueError('Image wider than the atlas: %s' % (sizes[i],))
+        if x + w > max_width:
+            x = 0
+            y += row_height + padding
+            row_height = 0
+        rects[i] = pygame.Rect(x, y, w, h)
+        x += w + padding
+        row_height = max(row_height, h)
+        width = max(width, x - padding)
+    return rects, (width, y + row_height)
+
+
+def _keys(manifest=None) -> set:
+    """
+    Return the image cache keys of the colorkeyed images of 'manifest'
+    (main.IMAGE_MANIFEST if not given), the ones an atlas of it holds.
+    """
+    return {main._image_key(name, colorkey, scale)
+            for name, colorkey, scale in manifest or main.IMAGE_MANIFEST
+            if colorkey is not None}
+
+
+def build(manifest=None) -> Tuple[pygame.Surface, List[dict]]:
+    """
+    Decode the colorkeyed images of 'manifest' (main.IMAGE_MANIFEST if not
+    given) and pack them into an atlas. Return the atlas, with KEY_COLOR as
+    colorkey, and its index: one dict of 'name', 'colorkey', 'scale' and
+    'rect' per image. Like main._read_image(), this needs the display to be
+    initialized but not its mode, and the atlas is not converted.
+    """
+    entries = []
+    images = []
+    for name, colorkey, scale in manifest or main.IMAGE_MANIFEST:
+        if colorkey is None:
+            continue
+        key = main._image_key(name, colorkey, scale)
+        if any(main._image_key(entry['name'], entry['colorkey'], entry['scale']) == key
+               for entry in entries):
+            continue
+        image = main._read_image(name, colorkey, scale)
+        # Check that the image does not use the key color of the atlas
+        opaque = pygame.mask.from_surface(image)
+        key_colored = pygame.mask.from_threshold(image, KEY_COLOR, (1, 1, 1, 255))
+        if opaque.overlap_area(key_colored, (0, 0)):
+            raise ValueError('%s uses the key color of the atlas' % name)
+        images.append(image)
+        entries.append({'name': name, 'colorkey': colorkey, 'scale': scale})
+
+    rects, size = pack([image.get_size() for image in images])
+    surface = pygame.Surface(size, 0, 32)
+    surface.fill(KEY_COLOR)
+    for entry, image, rect in zip(entries, images, rects):
+        surface.blit(image, rect)
+        entry['rect'] = list(rect)
+    surface.set_colorkey(KEY_COLOR)
+    return surface, entries
+
+
+def save(surface: pygame.Surface, index: List[dict], path: Path):
+    """
+    Write the atlas to the PNG file 'path' and its index next to it as JSON,
+    each with imagecache.write_file().
+    """
+    path = Path(path)
+    png = io.BytesIO()
+    pygame.image.save(surface, png, 'png')
+    imagecache.write_file(path, png.getvalue())
+    imagecache.write_file(path.with_suffix('.json'), json.dumps(
+        {'key_color': KEY_COLOR, 'images': index}, indent=1).encode())
+
+
+def read(path: Path, manifest=None) -> Optional[Tuple[pygame.Surface, List[dict]]]:
+    """
+    Read the atlas saved at 'path' and return it, not converted, with its
+    index. Return None if there is no atlas, if an image file was changed
+    after it was built, or if it does not hold exactly the images build()
+    would pack from 'manifest', e.g. after one was added or scaled anew.
+    This can run in any thread, like build().
+    """
+    path = Path(path)
+    index_path = path.with_suffix('.json')
+    if not path.exists() or not index_path.exists():
+        return None
+    try:
+        with open(index_path) as file:
+            index = json.load(file)
+        if {main._image_key(entry['name'], entry['colorkey'], entry['scale'])
+                for entry in index['images']} != _keys(manifest):
+            return None
+        built = path.stat().st_mtime
+        if any((main.IMG_DIR / name).stat().st_mtime > built
+               for name in {entry['name'] for entry in index['images']}):
+            return None
+        if main.IMG_CACHE_DIR is not None:
+            surface = imagecache.load(main.IMG_CACHE_DIR, path, (),
+                                      lambda: pygame.image.load(str(path)))
+        else:
+            surface = pygame.image.load(str(path))
+    except (OSError, ValueError, pygame.error):
+        return None
+    surface.set_colorkey(index['key_color'])
+    return surface, index['images']
+
+
+def load(path: Path, manifest=None, copy: bool = True) -> Dict[tuple, pygame.Surface]:
+    """
+    Read the atlas of 'manifest' saved at 'path' and return each of its
+    images, keyed like the image cache of main. Return an empty dict if
+    read() returns None. Needs the display mode to be set.
+    """
+    atlas = read(path, manifest)
+    if atlas is None:
+        return {}
+    surface, index = atlas
+    return cut(main._convert_image(surface), index, copy)
+
+
+def cut(surface: pygame.Surface, index: List[dict],
+        copy: bool = True) -> Dict[tuple, pygame.Surface]:
+    """
+    Return the images of the converted atlas 'surface' with 'index', keyed
+    like the image cache of main.
+
+    The images are subsurfaces of the atlas. If 'copy' is True, each one is
+    copied out into its own RLE accelerated surface, because SDL cannot RLE
+    encode a subsurface and blits the subsurface itself about 1.6 times
+    slower.
+    """
+    images = {}
+    for entry in index:
+        image = surface.subsurface(entry['rect'])
+        if copy:
+            image = image.copy()
+            image.set_colorkey(surface.get_colorkey(), pygame.RLEACCEL)
+        images[main._image_key(entry['name'], entry['colorkey'], entry['scale'])] = image
+    return images
+
+
+def read_or_build(path: Path, manifest=None) -> Tuple[pygame.Surface, List[dict]]:
+    """
+    Return the atlas of 'manifest' at 'path' and its index like read(). If
+    it cannot be used, build it from 'manifest' instead and try to save it
+    to 'path'.
+    """
+    atlas = read(path, manifest)
+    if atlas is not None:
+        return atlas
+    surface, index = build(manifest)
+    try:
+        save(surface, index, path)
+    except (OSError, pygame.error) as error:
+        print('Warning: cannot save the image atlas:', error)
+    return surface, index
+
+
+def load_or_build(path: Path, manifest=None) -> Dict[tuple, pygame.Surface]:
+    """
+    Return the images of the atlas at 'path' like load(), building it first
+    if needed (see read_or_build()). Needs the display mode to be set.
+    """
+    surface, index = read_or_build(path, manifest)
+    return cut(main._convert_image(surface), index)
+
+
+if __name__ == '__main__':
+    import game
+    game.setup_headless()
+    atlas_surface, atlas_index = build()
+    save(atlas_surface, atlas_index, main.ATLAS_PATH)
+    print('Packed %d images into %s, %dx%d'
+          % (len(atlas_index), main.ATLAS_PATH, *atlas_surface.get_size()))
@@ -0,0 +1,124 @@
+"""
+Play many seeded headless games with the scripted DodgeBot on all CPU cores,
+over a grid of gameplay constants, to help balancing the difficulty.
+
+    python batch.py --games 200 --set HP_BOSS=150,200,250 --set FIRE_WAIT=20,25
+
+Each row of the results table is one game: the constants used, the seed,
+the frames survived, the score, the bosses killed, the most enemy missiles
+on screen at once and the wall-clock time of the game.
+"""
+import argparse
+import ast
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+import game
+import inputs
+import main
+import sprites
+
+
+# Gameplay constants of the main and sprites modules that can be swept
+PARAMETERS = ('HP_ENEMY', 'HP_BOSS', 'ENEMY_FIRE_PERIOD', 'FIRE_WAIT', 'HIT_HP_DROP',
+              'COLLIDE_HP_DROP', 'INITIAL_HP', 'HP_INCREMENT', 'HP_PACK_PROB',
+              'POWER_UP_PROB')
+RESULT_COLUMNS = ('seed', 'frames', 'score', 'bosses_killed', 'peak_enemy_missiles',
+                  'runtime_ms')
+
+_state = None  # The GameState reused by all games of a worker process
+
+
+def _init_worker():
+    """Set up pygame without window and sound in a worker process."""
+    global _state
+    game.setup_headless()
+    _state = game.GameState()
+
+
+def set_parameters(parameters: Dict[str, float]):
+    """Set the gameplay constants in every module that defines them."""
+    for name, value in parameters.items():
+        if name not in PARAMETERS:
+            raise ValueError('Unknown parameter: %s' % name)
+        for module in (main, sprites):
+            if hasattr(module, name):
+                setattr(module, name, value)
+
+
+def play_game(task: Tuple[Dict[str, float], int, int]) -> Tuple:
+    """Play one game of a (parameters, seed, max_frames) task and return its results."""
+    parameters, seed, max_frames = task
+    set_parameters(parameters)
+    _state.reset(seed)
+    start_time = time.perf_counter()
+    game.play(_state, inputs.DodgeBot(_state), max_frames)
+    runtime = time.perf_counter() - start_time
+    return (seed, _state.frame, int(_state.score), _state.bosses_killed,
+            _state.peak_enemy_missiles, round(runtime * 1000, 1))
+
+
+def parse_sweep(settings: List[str]) -> Dict[str, list]:
+    """Parse 'NAME=value1,value2,...' settings into a dict of value lists."""
+    sweep = {}
+    for setting in settings:
+        name, _, values = setting.partition('=')
+        if name not in PARAMETERS:
+            raise SystemExit('Unknown parameter: %s (choose from %s)'
+                             % (name, ', '.join(PARAMETERS)))
+        sweep[name] = [ast.literal_eval(value) for value in values.split(',')]
+    return sweep
+
+
+def run(sweep: Dict[str, list], games: int, max_frames: int = None, first_seed: int = 0,
+        workers: int = None) -> List[Tuple]:
+    """
+    Play 'games' games with seeds from 'first_seed' on for every combination
+    of the values in 'sweep', in a pool of 'workers' processes. Return one
+    row per game: the swept values followed by RESULT_COLUMNS.
+    """
+    names = list(sweep)
+    combinations = list(itertools.product(*sweep.values()))
+    tasks = [(dict(zip(names, values)), seed, max_frames)
+             for values in combinations
+             for seed in range(first_seed, first_seed + games)]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        results = executor.map(play_game, tasks, chunksize=chunksize)
+        return [tuple(task[0].values()) + result for task, result in zip(tasks, results)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play seeded headless games in parallel')
+    parser.add_argument('--games', type=int, default=10,
+                        help='games per combination of constants')
+    parser.add_argument('--frames', type=int, default=None,
+                        help='end each game after this many frames')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes (default: all cores)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=V1,V2',
+                        help='constant to sweep, one of: ' + ', '.join(PARAMETERS))
+    parser.add_argument('--output', default=None,
+                        help='CSV file for the results (default: standard output)')
+    args = parser.parse_args()
+
+    sweep = parse_sweep(args.set)
+    start = time.perf_counter()
+    rows = run(sweep, args.games, args.frames, args.seed, args.workers)
+    elapsed = time.perf_counter() - start
+
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = csv.writer(output)
+    writer.writerow(list(sweep) + list(RESULT_COLUMNS))
+    writer.writerows(rows)
+    if args.output:
+        output.close()
+    frames = sum(row[len(sweep) + 1] for row in rows)
+    print('%d games, %d frames in %.2f s, %.0f frames/s'
+          % (len(rows), frames, elapsed, frames / elapsed), file=sys.stderr)
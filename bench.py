@@ -0,0 +1,371 @@
+"""
+Benchmark the game loop headlessly under stress scenarios.
+
+    python bench.py --output results.json
+    python bench.py --baseline results.json
+
+Every scenario is a seeded game whose plane cannot die, loaded with more
+of one kind of work than a normal game has. For each scenario the time of
+the update (spawning and moving), collision and draw phases of a frame is
+measured, as well as the memory allocated during a frame and the most
+sprites alive at once. The results can be saved as JSON and compared with
+a saved baseline, in which case the exit status is 1 if anything got
+slower. Comparing the two kinds of collisions the same way shows what the
+narrow phase of 'mask' collisions costs over the circles alone:
+
+    python bench.py --collisions circle --output circle.json
+    python bench.py --collisions mask --baseline circle.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+import pygame
+import bullets
+import game
+import inputs
+import main
+import sprites
+
+
+IMMORTAL_HP = 10 ** 9
+
+# Metrics compared with a baseline, and the smallest increase of each that
+# counts as a regression however large it is relative to the baseline
+COMPARED = {
+    'update_ms': 0.05,
+    'collision_ms': 0.05,
+    'draw_ms': 0.05,
+    'frame_ms': 0.1,
+    'frame_p95_ms': 0.2,
+    'alloc_kb_per_frame': 1.0,
+}
+
+
+class Scenario:
+    """
+    A plain game where the plane cannot be destroyed. Subclasses add load
+    in setup() and tick(), which is called at the start of every frame.
+    """
+    frames = 1500
+
+    def __init__(self, state: game.GameState, seed: int):
+        self.state = state
+        self.random = random.Random(seed)
+
+    def setup(self):
+        """Prepare the state right after it was reset."""
+
+    def tick(self):
+        """Add the load of a frame. The plane's HP is filled up."""
+        self.state.plane.hp = IMMORTAL_HP
+
+    def buttons(self) -> int:
+        """Return the buttons held down in this frame."""
+        return 0
+
+
+class EnemyRings(Scenario):
+    """Many enemies firing the ring patterns of Enemy._fire, replaced as they leave."""
+    enemies = 20
+    fire_cycle = 30
+
+    def tick(self):
+        super().tick()
+        state = self.state
+        while len(state.enemies) < self.enemies:
+            enemy = sprites.Enemy()
+            enemy.number_appear = 4 * (len(state.enemies) % 2)  # The two ring patterns
+            enemy.appearnce()
+            enemy.fire_cycle = self.fire_cycle
+            enemy.frame = self.random.randrange(self.fire_cycle)
+            enemy.hp = IMMORTAL_HP
+            enemy.add(state.allsprites, state.enemies)
+
+
+class BossPatterns(Scenario):
+    """All five bosses firing their patterns at once."""
+    fire_period = 30
+
+    def setup(self):
+        state = self.state
+        state.boss_fire_period = self.fire_period
+        for number in range(5):
+            boss = sprites.Boss()
+            boss.number_appear = number
+            boss.appearnce()
+            boss.hp = IMMORTAL_HP
+            boss.add(state.allsprites, state.bosses)
+
+
+class MissileSpam(Scenario):
+    """The plane at power level 2 firing every frame into a row of enemies."""
+    enemies = 8
+
+    def setup(self):
+        self.state.fire_period = 1
+
+    def tick(self):
+        super().tick()
+        state = self.state
+        plane = state.plane
+        while plane.power < 2:
+            plane.powerup()
+        while len(state.enemies) < self.enemies:
+            enemy = sprites.Enemy()
+            enemy.number_appear = 1
+            enemy.appearnce()
+            enemy.fire_cycle = 10 ** 6  # Enemies only take the hits
+            enemy.frame = 1
+            enemy.hp = IMMORTAL_HP
+            enemy.add(state.allsprites, state.enemies)
+
+
+class ExplosionStorm(Scenario):
+    """Many enemy explosions started every frame through ExplosionEnemy.position."""
+    explosions = 30
+
+    def tick(self):
+        super().tick()
+        area = self.state.area
+        for _ in range(self.explosions):
+            sprites.ExplosionEnemy.position((self.random.randrange(area.width),
+                                             self.random.randrange(area.height)))
+
+
+class BossFight(Scenario):
+    """
+    The DodgeBot fighting the first boss. The game up to 'start_frame' is
+    played once per seed and settings, and every run starts from a snapshot
+    of it (see game.GameState.snapshot()).
+    """
+    start_frame = 1600  # The first boss appears in frame 1500
+    snapshots = {}  # Snapshot of the start, keyed by the seed and settings
+
+    def __init__(self, state: game.GameState, seed: int):
+        super().__init__(state, seed)
+        self.seed = seed
+        self.bot = inputs.DodgeBot(state)
+
+    def setup(self):
+        state = self.state
+        key = (self.seed, state.bullet_field is not None, state.substeps, state.collisions)
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            while state.frame < self.start_frame:
+                state.plane.hp = IMMORTAL_HP
+                state.step(self.bot())
+            snapshot = self.snapshots[key] = state.snapshot()
+        state.restore(snapshot)
+
+    def buttons(self) -> int:
+        return self.bot()
+
+
+class Soak(Scenario):
+    """Long run of normal games played by the DodgeBot, starting a new one at game over."""
+    frames = 20000
+
+    def __init__(self, state: game.GameState, seed: int):
+        super().__init__(state, seed)
+        self.bot = inputs.DodgeBot(state)
+
+    def tick(self):
+        pass
+
+    def buttons(self) -> int:
+        return self.bot()
+
+
+SCENARIOS = {
+    'enemy_rings': EnemyRings,
+    'boss_patterns': BossPatterns,
+    'missile_spam': MissileSpam,
+    'explosion_storm': ExplosionStorm,
+    'boss_fight': BossFight,
+    'soak': Soak,
+}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    """Return the value below which 'fraction' of the sorted 'values' lie."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(screen: pygame.Surface, scenario_class, frames: int, seed: int = 0,
+                 trace: bool = False) -> Dict[str, float]:
+    """
+    Play 'frames' frames of a scenario and return its metrics. With 'trace',
+    only the memory allocated per frame is measured, with tracemalloc, since
+    tracing slows down everything else.
+    """
+    state, renderer = main.create_view(screen)
+    state.reset(seed)
+    scenario = scenario_class(state, seed)
+    scenario.setup()
+    bullet_field = state.bullet_field
+    games = 1
+    peak_sprites = 0
+    update_times = []
+    collision_times = []
+    draw_times = []
+    allocated = []
+    clock = time.perf_counter
+    if trace:
+        tracemalloc.start()
+
+    for _ in range(frames):
+        if trace:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:  # Python < 3.9, forget the traces to restart the peak from zero
+                tracemalloc.clear_traces()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = clock()
+        state.begin_frame(scenario.buttons())
+        scenario.tick()
+        state.spawn()
+        collision_time = 0.0
+        for _ in range(state.substeps):
+            substep = clock()
+            state.collide()
+            collision_time += clock() - substep
+            if state.plane.hp <= 0:
+                break
+            state.move()
+        if state.plane.hp <= 0:
+            state.reset(seed + games)
+            scenario.setup()
+            games += 1
+            continue
+        state.update()
+        moved = clock()
+        renderer.draw_frame()
+        drawn = clock()
+        if trace:
+            allocated.append(tracemalloc.get_traced_memory()[1] - start_memory)
+            continue
+
+        update_times.append(moved - start - collision_time)
+        collision_times.append(collision_time)
+        draw_times.append(drawn - moved)
+        live = len(state.allsprites) + (len(bullet_field) if bullet_field is not None else 0)
+        if live > peak_sprites:
+            peak_sprites = live
+
+    if trace:
+        tracemalloc.stop()
+        return {'alloc_kb_per_frame': round(sum(allocated) / len(allocated) / 1024, 2),
+                'alloc_kb_max': round(max(allocated) / 1024, 2)}
+
+    frame_times = sorted(map(sum, zip(update_times, collision_times, draw_times)))
+    count = len(frame_times)
+    return {
+        'frames': count,
+        'games': games,
+        'update_ms': round(1000 * sum(update_times) / count, 4),
+        'collision_ms': round(1000 * sum(collision_times) / count, 4),
+        'draw_ms': round(1000 * sum(draw_times) / count, 4),
+        'frame_ms': round(1000 * sum(frame_times) / count, 4),
+        'frame_p50_ms': round(1000 * _percentile(frame_times, 0.5), 4),
+        'frame_p95_ms': round(1000 * _percentile(frame_times, 0.95), 4),
+        'frame_max_ms': round(1000 * frame_times[-1], 4),
+        'peak_sprites': peak_sprites,
+        'peak_enemy_missiles': state.peak_enemy_missiles,
+    }
+
+
+def run(names: List[str], frames: int = None, alloc_frames: int = 300,
+        seed: int = 0) -> dict:
+    """Run the scenarios 'names' and return the results with the settings used."""
+    screen = game.setup_headless()
+    results = {}
+    for name in names:
+        scenario_class = SCENARIOS[name]
+        metrics = run_scenario(screen, scenario_class, frames or scenario_class.frames, seed)
+        if alloc_frames:
+            metrics.update(run_scenario(screen, scenario_class, alloc_frames, seed, trace=True))
+        results[name] = metrics
+        print('%-16s %s' % (name, ', '.join('%s %s' % item for item in metrics.items())),
+              file=sys.stderr)
+    return {
+        'settings': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': bullets.np.__version__ if bullets.np is not None else None,
+            'backend': main.ENEMY_MISSILE_BACKEND,
+            'renderer': main.RENDERER,
+            'collisions': main.COLLISIONS,
+            'seed': seed,
+        },
+        'scenarios': results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Return a line for every metric of COMPARED that is more than 'tolerance'
+    (relative) and its floor (absolute) above the baseline.
+    """
+    regressions = []
+    if results['settings'] != baseline['settings']:
+        print('Warning: the baseline was measured with other settings: %s'
+              % baseline['settings'], file=sys.stderr)
+    for name, metrics in results['scenarios'].items():
+        old_metrics = baseline['scenarios'].get(name)
+        if old_metrics is None:
+            continue
+        for metric, floor in COMPARED.items():
+            if metric not in metrics or metric not in old_metrics:
+                continue
+            new, old = metrics[metric], old_metrics[metric]
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append('%s %s: %s -> %s (%+.0f%%)'
+                                   % (name, metric, old, new, 100 * (new - old) / old))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the game under stress scenarios')
+    parser.add_argument('--only', action='append', choices=list(SCENARIOS), default=None,
+                        help='run only this scenario (can be repeated)')
+    parser.add_argument('--frames', type=int, default=None,
+                        help='frames per scenario (default: depends on the scenario)')
+    parser.add_argument('--alloc-frames', type=int, default=300,
+                        help='frames of the allocation measurement, 0 to skip it')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the games')
+    parser.add_argument('--backend', choices=('sprite', 'numpy'), default=None,
+                        help='enemy missile backend (default: main.ENEMY_MISSILE_BACKEND)')
+    parser.add_argument('--renderer', choices=('full', 'dirty'), default=None,
+                        help='renderer (default: main.RENDERER)')
+    parser.add_argument('--collisions', choices=('circle', 'mask'), default=None,
+                        help='collision test (default: main.COLLISIONS)')
+    parser.add_argument('--output', default=None, help='save the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON file of earlier results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown allowed against the baseline')
+    args = parser.parse_args()
+
+    if args.backend:
+        main.ENEMY_MISSILE_BACKEND = args.backend
+    if args.renderer:
+        main.RENDERER = args.renderer
+    if args.collisions:
+        main.COLLISIONS = args.collisions
+    results = run(args.only or list(SCENARIOS), args.frames, args.alloc_frames, args.seed)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print('Regression: ' + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print('No regressions', file=sys.stderr)
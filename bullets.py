@@ -0,0 +1,184 @@
+"""
+This module provides a NumPy backend for enemy missiles. All missiles live
+in a few arrays and are moved, culled, hit tested and drawn in batches.
+"""
+import math
+from typing import Tuple
+import pygame
+import main
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BulletField:
+    """
+    Struct-of-arrays store of missiles sharing one image. Row i of 'pos' is
+    the top left corner of missile i, 'direction' its unit vector and 'speed'
+    its speed in pixels per frame. Only the first 'count' rows are live.
+
+    The motion matches sprites.EnemyMissile: 'pos' is kept in floats, moved
+    by the direction times the speed every frame, and a missile is drawn,
+    culled and hit tested at its position rounded to whole pixels. Collisions
+    use the circle around its rect like pygame.sprite.collide_circle, and
+    collide_mask() confirms those hits with the mask of the image, from
+    main.image_mask().
+    """
+    def __init__(self, image: pygame.Surface, area: pygame.Rect, capacity: int = 256,
+                 margin: int = 0):
+        if np is None:
+            raise ImportError('BulletField needs NumPy')
+        self.image = image
+        self.width, self.height = image.get_size()
+        self.radius = 0.5 * math.hypot(self.width, self.height)
+        self.area = area
+        self.margin = margin  # Missiles this many pixels beyond 'area' are dropped
+        self.count = 0
+        self.high_water = 0  # Most missiles live at the same time
+        self.pos = np.zeros((capacity, 2))
+        self.direction = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.velocity = np.zeros((capacity, 2))  # Pixels moved per frame
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, num: int):
+        """Grow the arrays so that 'num' more missiles fit."""
+        capacity = len(self.speed)
+        if self.count + num <= capacity:
+            return
+        while capacity < self.count + num:
+            capacity *= 2
+        for name in ('pos', 'direction', 'speed', 'velocity'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def spawn(self, location: Tuple[int, int], num: int = 1,
+              direction: Tuple[float, float] = (0, 1), speed: float = 4):
+        """
+        Place 'num' missiles side by side with their bottom at 'location', the
+        same way as sprites.EnemyMissile.position.
+        """
+        self._reserve(num)
+        start, end = self.count, self.count + num
+        centerx = [int((-(num-1)/2 + i)*30 + location[0]) for i in range(num)]
+        self.pos[start:end, 0] = centerx
+        self.pos[start:end, 0] -= self.width // 2
+        self.pos[start:end, 1] = location[1] - self.height
+        self.direction[start:end] = direction
+        self.speed[start:end] = speed
+        self.velocity[start:end] = self.direction[start:end] * speed
+        self.count = end
+        if end > self.high_water:
+            self.high_water = end
+
+    def _keep(self, keep):
+        """Compact the live rows, keeping those where the mask 'keep' is True."""
+        count = int(np.count_nonzero(keep))
+        if count == self.count:
+            return
+        for name in ('pos', 'direction', 'speed', 'velocity'):
+            array = getattr(self, name)
+            array[:count] = array[:self.count][keep]
+        self.count = count
+
+    def positions(self):
+        """Return the top left corners of the live missiles in whole pixels."""
+        return np.rint(self.pos[:self.count])
+
+    def move(self, dt: float = 1):
+        """Move every missile by its velocity of 'dt' frames."""
+        if self.count:
+            self.pos[:self.count] += self.velocity[:self.count] * dt
+
+    def update(self, margin: int = None):
+        """
+        Drop the missiles that left the screen by more than 'margin' pixels,
+        or by 'margin' given at creation if None.
+        """
+        if not self.count:
+            return
+        if margin is None:
+            margin = self.margin
+        pos = self.positions()
+        left, top = pos[:, 0], pos[:, 1]
+        area = self.area.inflate(2 * margin, 2 * margin)
+        self._keep((left + self.width > area.left) & (left < area.right)
+                   & (top + self.height > area.top) & (top < area.bottom))
+
+    def collide_circle(self, sprite: pygame.sprite.Sprite) -> int:
+        """
+        Remove the missiles whose circle overlaps the circle of 'sprite' and
+        return how many there were.
+        """
+        if not self.count:
+            return 0
+        pos = self.positions()
+        dx = pos[:, 0] + self.width // 2 - sprite.rect.centerx
+        dy = pos[:, 1] + self.height // 2 - sprite.rect.centery
+        hit = dx * dx + dy * dy <= (sprite.radius + self.radius) ** 2
+        hits = int(np.count_nonzero(hit))
+        if hits:
+            self._keep(~hit)
+        return hits
+
+    def collide_mask(self, sprite: pygame.sprite.Sprite, mask: pygame.mask.Mask) -> int:
+        """
+        Remove the missiles that hit 'sprite', whose image has the collision
+        mask 'mask', and return how many there were. Only the missiles that
+        collide_circle() would remove have their mask compared.
+        """
+        if not self.count:
+            return 0
+        pos = self.positions()
+        rect = sprite.rect
+        dx = pos[:, 0] + self.width // 2 - rect.centerx
+        dy = pos[:, 1] + self.height // 2 - rect.centery
+        hit = dx * dx + dy * dy <= (sprite.radius + self.radius) ** 2
+        if not hit.any():
+            return 0
+        own_mask = main.image_mask(self.image)
+        for i in np.flatnonzero(hit).tolist():
+            x, y = pos[i]
+            if mask.overlap(own_mask, (int(x) - rect.x, int(y) - rect.y)) is None:
+                hit[i] = False
+        hits = int(np.count_nonzero(hit))
+        if hits:
+            self._keep(~hit)
+        return hits
+
+    def clear(self):
+        """Remove every missile."""
+        self.count = 0
+
+    def snapshot(self) -> Tuple:
+        """Return copies of the live rows of the arrays, which restore() sets again."""
+        count = self.count
+        return (self.pos[:count].copy(), self.direction[:count].copy(),
+                self.speed[:count].copy(), self.velocity[:count].copy())
+
+    def restore(self, arrays: Tuple):
+        """Replace every missile with those of a snapshot()."""
+        self.count = 0
+        count = len(arrays[2])
+        self._reserve(count)
+        for name, array in zip(('pos', 'direction', 'speed', 'velocity'), arrays):
+            getattr(self, name)[:count] = array
+        self.count = count
+
+    def draw(self, surface: pygame.Surface, dirty: bool = False):
+        """
+        Blit all missiles to 'surface' in one call. If 'dirty' is True, return
+        the list of rects that were drawn.
+        """
+        if not self.count:
+            return []
+        image = self.image
+        return surface.blits([(image, position)
+                              for position in self.positions().astype(int).tolist()],
+                             doreturn=dirty)
@@ -0,0 +1,111 @@
+"""
+This module handles collision checks: the broad phase finds the sprites
+whose circles overlap, and collide_mask() can confirm those hits with the
+opaque pixels of the images as the narrow phase.
+"""
+import math
+from typing import Dict, List, Tuple
+import pygame
+import main
+
+
+def collide_mask(sprite, other) -> bool:
+    """
+    Return whether 'sprite' and 'other' collide according to
+    pygame.sprite.collide_circle and the opaque pixels of their images touch
+    (see masks_overlap()), which is only checked if their circles overlap.
+    """
+    return pygame.sprite.collide_circle(sprite, other) and masks_overlap(sprite, other)
+
+
+def masks_overlap(sprite, other) -> bool:
+    """
+    Return whether the opaque pixels of the images of 'sprite' and 'other'
+    touch at the positions of their rects. The masks are the cached ones of
+    main.image_mask().
+    """
+    rect, other_rect = sprite.rect, other.rect
+    return main.image_mask(sprite.image).overlap(
+        main.image_mask(other.image), (other_rect.x - rect.x, other_rect.y - rect.y)) is not None
+
+
+class SpatialHash:
+    """
+    Uniform grid that indexes sprites by the cells their bounding circle
+    covers, so that a sprite only has to be tested against nearby ones.
+    The radius of a sprite is found the same way as pygame.sprite.collide_circle
+    does: the 'radius' attribute, or half of the diagonal of its rect.
+    """
+    def __init__(self, cell_size: int = 64):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[pygame.sprite.Sprite]] = {}
+        self.sprite_cells: Dict[pygame.sprite.Sprite, List[Tuple[int, int]]] = {}
+
+    def __len__(self):
+        return len(self.sprite_cells)
+
+    def _cell_keys(self, sprite) -> List[Tuple[int, int]]:
+        """Return the keys of the cells covered by the bounding circle of 'sprite'."""
+        rect = sprite.rect
+        try:
+            radius = sprite.radius
+        except AttributeError:
+            radius = 0.5 * math.hypot(rect.width, rect.height)
+        size = self.cell_size
+        left = int((rect.centerx - radius) // size)
+        right = int((rect.centerx + radius) // size)
+        top = int((rect.centery - radius) // size)
+        bottom = int((rect.centery + radius) // size)
+        return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+    def clear(self):
+        """Remove every sprite from the grid."""
+        self.cells.clear()
+        self.sprite_cells.clear()
+
+    def insert(self, sprite):
+        """Add 'sprite' to the cells it covers at its current position."""
+        keys = self._cell_keys(sprite)
+        self.sprite_cells[sprite] = keys
+        for key in keys:
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = [sprite]
+            else:
+                cell.append(sprite)
+
+    def remove(self, sprite):
+        """Remove 'sprite' from the grid, e.g. once it has been recycled."""
+        keys = self.sprite_cells.pop(sprite, ())
+        for key in keys:
+            self.cells[key].remove(sprite)
+
+    def rebuild(self, sprites):
+        """Clear the grid and insert all of 'sprites' at their current positions."""
+        self.clear()
+        for sprite in sprites:
+            self.insert(sprite)
+
+    def candidates(self, sprite) -> List[pygame.sprite.Sprite]:
+        """Return the indexed sprites sharing at least one cell with 'sprite'."""
+        found = {}
+        for key in self._cell_keys(sprite):
+            cell = self.cells.get(key)
+            if cell:
+                found.update(dict.fromkeys(cell))
+        return list(found)
+
+    def collide_circle(self, sprite) -> List[pygame.sprite.Sprite]:
+        """
+        Return the indexed sprites that collide with 'sprite' according to
+        pygame.sprite.collide_circle, testing only the nearby candidates.
+        """
+        return [other for other in self.candidates(sprite)
+                if pygame.sprite.collide_circle(sprite, other)]
+
+    def collide_mask(self, sprite) -> List[pygame.sprite.Sprite]:
+        """
+        Return the indexed sprites that collide with 'sprite' according to
+        collide_mask(), testing only the nearby candidates.
+        """
+        return [other for other in self.candidates(sprite) if collide_mask(sprite, other)]
@@ -0,0 +1,232 @@
+"""
+Gym-style environments for training agents on the game, without window,
+sound or keyboard. VectorEnv plays a batch of independent games in one
+process, Env a single game.
+
+    environment = env.VectorEnv(8, frame_skip=4, size=(84, 84), grayscale=True)
+    observations = environment.reset(seed=0)
+    observations, rewards, dones, infos = environment.step(actions)
+
+An action is an index into ACTIONS, the buttons held down for the step. The
+reward is the score gained, so surviving, shooting enemies and bosses all
+count. Observations are NumPy arrays of uint8, either the game drawn on an
+offscreen surface and downscaled ('screen'), or built from the positions of
+the sprites without drawing anything ('grid').
+"""
+from typing import List, Tuple
+import numpy as np
+import pygame
+import game
+import sprites
+from inputs import DOWN, LEFT, RIGHT, UP
+
+
+# Button mask of each action: none, the four directions, then the diagonals
+ACTIONS = (0, UP, DOWN, LEFT, RIGHT, UP | LEFT, UP | RIGHT, DOWN | LEFT, DOWN | RIGHT)
+OBSERVATIONS = ('screen', 'grid')
+# Channels of a grid observation
+GRID_CHANNELS = ('plane', 'missiles', 'enemies', 'bosses', 'enemy_missiles', 'items')
+GRAY_WEIGHTS = (77, 150, 29)  # Luma weights of red, green and blue in 256ths
+
+
+class VectorEnv:
+    """
+    'count' games stepped together. Each step holds the buttons of an action
+    for 'frame_skip' frames, or until the game is over, and the observation
+    is only made after the last one.
+
+    The observation of a game is 'size' (width, height) pixels. A 'screen'
+    observation is the sprites drawn on black and scaled down, of shape
+    (height, width, 3), or (height, width) if 'grayscale'. A 'grid'
+    observation has one channel per kind of GRID_CHANNELS, of shape
+    (channels, height, width), where a cell is 255 if the center of a sprite
+    of that kind is in it.
+
+    A game ends when the plane is destroyed or after 'max_frames' frames.
+    It is then reset right away with the next seed, and step() returns the
+    observation of the new game, while the info of the ended game holds its
+    last observation as 'terminal_observation'.
+    """
+    def __init__(self, count: int, frame_skip: int = 1, observation: str = 'screen',
+                 size: Tuple[int, int] = (84, 84), grayscale: bool = False,
+                 max_frames: int = None, bullet_backend: str = None):
+        if observation not in OBSERVATIONS:
+            raise ValueError('Unknown observation: %s (choose from %s)'
+                             % (observation, ', '.join(OBSERVATIONS)))
+        if frame_skip < 1:
+            raise ValueError('frame_skip must be at least 1')
+        if pygame.display.get_surface() is None:
+            game.setup_headless()
+        self.count = count
+        self.frame_skip = frame_skip
+        self.observation = observation
+        self.size = tuple(size)
+        self.grayscale = grayscale
+        self.max_frames = max_frames
+        self.states = [game.GameState(bullet_backend=bullet_backend) for _ in range(count)]
+        self.area = self.states[0].area
+        self.canvas = pygame.Surface(self.area.size).convert()
+        self.small = pygame.Surface(self.size).convert()
+        width, height = self.size
+        if observation == 'grid':
+            self.observation_shape = (len(GRID_CHANNELS), height, width)
+        elif grayscale:
+            self.observation_shape = (height, width)
+        else:
+            self.observation_shape = (height, width, 3)
+        self.action_count = len(ACTIONS)
+        self.scores = [0.0] * count  # Score of each game at the end of the last step
+        self.next_seed = None
+
+    def _seed(self):
+        if self.next_seed is None:
+            return None
+        seed = self.next_seed
+        self.next_seed += 1
+        return seed
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        """
+        Start every game anew, game i with seed 'seed' + i and the games
+        after them with the seeds that follow, or random seeds if 'seed' is
+        None. Return the observations.
+        """
+        self.next_seed = seed
+        for i, state in enumerate(self.states):
+            state.reset(self._seed())
+            self.scores[i] = 0.0
+        return np.stack([self.observe(state) for state in self.states])
+
+    def step(self, actions) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[dict]]:
+        """
+        Play an action (see ACTIONS) in every game. Return the observations,
+        the rewards, whether each game ended and an info dict per game with
+        its 'seed', 'frame', 'score' and 'hp'. There must be one action per
+        game.
+        """
+        if len(actions) != self.count:
+            raise ValueError('Expected %d actions, one per game, got %d'
+                             % (self.count, len(actions)))
+        observations = np.empty((self.count,) + self.observation_shape, np.uint8)
+        rewards = np.zeros(self.count, np.float32)
+        dones = np.zeros(self.count, bool)
+        infos = []
+        for i, (state, action) in enumerate(zip(self.states, actions)):
+            buttons = ACTIONS[action]
+            alive = True
+            for _ in range(self.frame_skip):
+                alive = state.step(buttons)
+                if not alive or state.frame == self.max_frames:
+                    break
+            rewards[i] = state.score - self.scores[i]
+            info = {'seed': state.seed, 'frame': state.frame, 'score': state.score,
+                    'hp': state.plane.hp}
+            if alive and state.frame != self.max_frames:
+                self.scores[i] = state.score
+            else:
+                dones[i] = True
+                info['terminal_observation'] = self.observe(state)
+                state.reset(self._seed())
+                self.scores[i] = 0.0
+            observations[i] = self.observe(state)
+            infos.append(info)
+        return observations, rewards, dones, infos
+
+    def observe(self, state: game.GameState) -> np.ndarray:
+        """Return the observation of 'state'."""
+        if self.observation == 'grid':
+            return self._grid(state)
+        canvas = self.canvas
+        canvas.fill((0, 0, 0))
+        state.allsprites.draw(canvas)
+        if state.bullet_field is not None:
+            state.bullet_field.draw(canvas)
+        pygame.transform.scale(canvas, self.size, self.small)
+        pixels = pygame.surfarray.pixels3d(self.small)  # (width, height, 3), no copy
+        if self.grayscale:
+            red, green, blue = GRAY_WEIGHTS
+            image = ((pixels[:, :, 0] * np.uint16(red) + pixels[:, :, 1] * np.uint16(green)
+                      + pixels[:, :, 2] * np.uint16(blue)) >> 8).T.astype(np.uint8)
+        else:
+            image = pixels.transpose(1, 0, 2).copy()
+        del pixels  # Unlock the surface
+        return image
+
+    def _grid(self, state: game.GameState) -> np.ndarray:
+        pools = state.pools
+        enemy_missiles = [missile.rect.center for missile in pools[sprites.EnemyMissile].active]
+        field = state.bullet_field
+        if field is not None and field.count:
+            enemy_missiles.extend((field.positions() + (field.width // 2, field.height // 2))
+                                  .tolist())
+        kinds = (
+            [state.plane.rect.center],
+            [missile.rect.center for missile in pools[sprites.Missile].active],
+            [enemy.rect.center for enemy in state.enemies],
+            [boss.rect.center for boss in state.bosses],
+            enemy_missiles,
+            [item.rect.center for item in (state.powerup, state.hp_pack)
+             if item in state.allsprites],
+        )
+        width, height = self.size
+        grid = np.zeros(self.observation_shape, np.uint8)
+        for channel, centers in enumerate(kinds):
+            if not centers:
+                continue
+            centers = np.asarray(centers, float)
+            columns = (centers[:, 0] * width / self.area.width).astype(int)
+            rows = (centers[:, 1] * height / self.area.height).astype(int)
+            inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+            grid[channel, rows[inside], columns[inside]] = 255
+        return grid
+
+
+class Env:
+    """
+    A single game with the interface of a Gym environment, taking the
+    arguments of VectorEnv apart from the count.
+    """
+    def __init__(self, **options):
+        self.vector = VectorEnv(1, **options)
+        self.observation_shape = self.vector.observation_shape
+        self.action_count = self.vector.action_count
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        """Start a new game and return its observation."""
+        return self.vector.reset(seed)[0]
+
+    def step(self, action: int) -> Tuple[np.ndarray, float, bool, dict]:
+        """Play 'action' and return the observation, reward, whether the game ended and info."""
+        observations, rewards, dones, infos = self.vector.step((action,))
+        return observations[0], float(rewards[0]), bool(dones[0]), infos[0]
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description='Measure the steps per second of the environment')
+    parser.add_argument('--games', type=int, default=8, help='games in the batch')
+    parser.add_argument('--steps', type=int, default=1000, help='steps to take')
+    parser.add_argument('--frame-skip', type=int, default=4, help='frames per step')
+    parser.add_argument('--observation', choices=OBSERVATIONS, default='screen')
+    parser.add_argument('--size', type=int, nargs=2, default=(84, 84), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--grayscale', action='store_true', help='grayscale screen observations')
+    args = parser.parse_args()
+
+    environment = VectorEnv(args.games, args.frame_skip, args.observation, args.size,
+                            args.grayscale)
+    environment.reset(seed=0)
+    choose = random.Random(0).randrange
+    games_ended = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        _, _, ended, _ = environment.step([choose(environment.action_count)
+                                           for _ in range(args.games)])
+        games_ended += int(ended.sum())
+    elapsed = time.perf_counter() - start
+    steps = args.steps * args.games
+    print('%d steps of %d frames in %.2f s: %.0f steps/s, %.0f frames/s, %d games ended'
+          % (steps, args.frame_skip, elapsed, steps / elapsed,
+             steps * args.frame_skip / elapsed, games_ended))
@@ -0,0 +1,527 @@
+"""
+This module holds the state of a game and advances it one frame at a time,
+independently of how, or whether, it is drawn.
+"""
+from operator import attrgetter
+import os
+import random
+from typing import List, NamedTuple, Optional, Tuple
+import pygame
+import bullets
+import collision
+import main
+import sprites
+import telemetry
+
+
+def setup_headless(size: Tuple[int, int] = (480, 640)) -> pygame.Surface:
+    """
+    Initialize pygame for running games without a window or sound: the
+    display uses the dummy video driver and the mixer is not started.
+    Return the display surface, with every image already preloaded.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode(size)
+    main.preload_images()
+    return screen
+
+
+# Letter standing for each kind of sprite in a Snapshot
+SPRITE_KINDS = {
+    sprites.Plane: 'p',
+    sprites.Missile: 'm',
+    sprites.EnemyMissile: 'n',
+    sprites.ExplosionEnemy: 'x',
+    sprites.ExplosionBoss: 'X',
+    sprites.PowerUp: 'u',
+    sprites.HpPack: 'h',
+    sprites.Enemy: 'e',
+    sprites.Boss: 'b',
+}
+
+
+class Snapshot(NamedTuple):
+    """
+    The state of a game between two frames, in numbers, strings and arrays
+    only (see GameState.snapshot()). It can be pickled, e.g. to save it.
+    """
+    values: tuple  # The attributes of GameState.SNAPSHOT_ATTRIBUTES
+    rng: tuple  # State of the random number generator
+    kinds: str  # Letter of SPRITE_KINDS of each sprite of 'allsprites', in order
+    sprites: tuple  # Sprite.snapshot() of each sprite of 'allsprites'
+    bullets: Optional[tuple]  # BulletField.snapshot() of the bullet field, if any
+
+
+class GameState:
+    """
+    Everything that makes up one game: the plane, enemies, bosses, items,
+    the missile and explosion pools, the score and the boss progression.
+
+    All randomness comes from the state's own 'rng', so a game is fully
+    determined by its seed and the buttons of every frame.
+
+    The sprite classes find their pools, groups and random numbers through
+    class and module attributes, so a state has to be bound before its
+    sprites are created or updated. step() binds it, which makes it possible
+    to advance several states in turns. While a state is bound,
+    Enemy.initial_hp and Boss.initial_hp hold its values.
+
+    If 'telemetry' is set to a telemetry.Telemetry, the events of the game
+    are logged to it under the number 'session'.
+    """
+    bound = None  # The state whose pools and groups the sprite classes use
+    # Attributes that change during a game, saved by snapshot()
+    SNAPSHOT_ATTRIBUTES = ('seed', 'score', 'frame', 'frame_record', 'game_over',
+                           'peak_enemy_missiles', 'fire_period', 'boss_fire_period', 'mark',
+                           'initial_boss_appear', 'boss_number_appear')
+    _snapshot_values = staticmethod(attrgetter(*SNAPSHOT_ATTRIBUTES))
+
+    def __init__(self, group_class=pygame.sprite.Group,
+                 bullet_backend: str = None, substeps: int = None, collisions: str = None):
+        """
+        'group_class' is the type of the 'allsprites' group, which a renderer
+        may need to be a particular one. 'bullet_backend' is 'sprite' or
+        'numpy' (see main.ENEMY_MISSILE_BACKEND). 'substeps' is the number
+        of movement and collision steps per frame (see main.STEP_RATE).
+        'collisions' is 'circle' or 'mask' (see main.COLLISIONS).
+        """
+        if bullet_backend is None:
+            bullet_backend = main.ENEMY_MISSILE_BACKEND
+        if substeps is None:
+            if main.STEP_RATE % main.FRAME_RATE:
+                raise ValueError('STEP_RATE must be a multiple of FRAME_RATE')
+            substeps = main.STEP_RATE // main.FRAME_RATE
+        self.substeps = substeps
+        if collisions is None:
+            collisions = main.COLLISIONS
+        self.collisions = collisions
+        self.area = pygame.display.get_surface().get_rect()
+        sprites.Enemy.all_images = [main.load_image('enemy{}.png'.format(i),
+                                                    colorkey=-1,
+                                                    scale=(32, 34))[0] for i in range(1, 6)]
+        sprites.Boss.all_images = [main.load_image('boss{}.png'.format(i),
+                                                   colorkey=-1,
+                                                   scale=(96, 102))[0] for i in range(1, 6)]
+
+        self.plane = sprites.Plane()
+        self.allsprites = group_class(self.plane)
+        self.enemies = pygame.sprite.Group()
+        self.bosses = pygame.sprite.Group()
+
+        # The missiles and explosions are created up front and reused
+        self.pools = {
+            sprites.Missile: sprites.Pool(sprites.Missile, main.MISSILE_POOL_SIZE,
+                                          main.MISSILE_POOL_MAX),
+            sprites.EnemyMissile: sprites.Pool(sprites.EnemyMissile,
+                                               main.ENEMY_MISSILE_POOL_SIZE,
+                                               main.ENEMY_MISSILE_POOL_MAX),
+            sprites.ExplosionEnemy: sprites.Pool(sprites.ExplosionEnemy,
+                                                 main.EXPLOSION_POOL_SIZE,
+                                                 main.EXPLOSION_POOL_MAX),
+            sprites.ExplosionBoss: sprites.Pool(sprites.ExplosionBoss, 1,
+                                                main.EXPLOSION_POOL_MAX),
+        }
+        self.bullet_field = None
+        if bullet_backend == 'numpy':
+            if bullets.np is None:
+                print('Warning: NumPy not found, using sprite enemy missiles')
+            else:
+                self.bullet_field = bullets.BulletField(
+                    main.load_image('bullet_enemy.png', colorkey=-1, scale=(5, 21))[0],
+                    self.area, margin=sprites.OFFSCREEN_MARGIN)
+
+        # Index of our plane's missiles used by the enemy and boss hit checks
+        self.missile_grid = collision.SpatialHash(main.COLLISION_CELL_SIZE)
+
+        self.enemy_initial_hp = sprites.HP_ENEMY
+        self.boss_initial_hp = sprites.HP_BOSS
+        self.rng = random.Random()
+        self.seed = None
+        self.telemetry = None
+        self.session = 0
+        self.bind()
+
+        # Create falling objects
+        self.hp_pack = sprites.HpPack()
+        self.powerup = sprites.PowerUp()
+
+        self.reset()
+
+    def bind(self):
+        """Let the sprite classes use the pools and groups of this state."""
+        previous = GameState.bound
+        if previous is self:
+            return
+        if previous is not None:
+            previous.enemy_initial_hp = sprites.Enemy.initial_hp
+            previous.boss_initial_hp = sprites.Boss.initial_hp
+        for pooled_class, pool in self.pools.items():
+            pooled_class.use_pool(pool, self.allsprites)
+        sprites.EnemyMissile.field = self.bullet_field
+        sprites.FallingItem.allsprites = self.allsprites
+        sprites.Enemy.initial_hp = self.enemy_initial_hp
+        sprites.Boss.initial_hp = self.boss_initial_hp
+        sprites.rng = self.rng
+        GameState.bound = self
+
+    def reset(self, seed: int = None):
+        """Start a new game, seeded with 'seed' or a random seed if not given."""
+        self.bind()
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.rng.seed(seed)
+
+        # Re-position the plane and take away a powerup left from a game
+        # that was cut short
+        self.plane.place_at_bottom_center()
+        self.plane.remove_powerup()
+
+        # Clearing the view by emptying all the groups
+        self.allsprites.empty()
+        self.allsprites.add(self.plane)
+        self.bosses.empty()
+        self.enemies.empty()
+        # Also empty those 'active' groups to avoid invisible missiles collide
+        # with our plane or enemies
+        for pool in self.pools.values():
+            pool.release_all()
+        if self.bullet_field is not None:
+            self.bullet_field.clear()
+
+        # Reinitialize the HP and battle constant values of all class and objects
+        self.plane.hp = main.INITIAL_HP
+        sprites.Enemy.initial_hp = sprites.HP_ENEMY
+        sprites.Boss.initial_hp = sprites.HP_BOSS
+        self.fire_period = 20
+        self.boss_fire_period = 70
+
+        self.mark = False # to identify whether enemy adds hp after 1 boss is defeated (enemy level up)
+        self.initial_boss_appear = True # to identify the first appearance of boss
+        self.boss_number_appear = 1 # the number of boss that has appeared including this one
+
+        # Reinitialize loop counter and scores
+        self.score = 0
+        self.frame = 0
+        self.frame_record = 0
+        self.game_over = False
+        self.boss_contact = False  # Whether the plane lost HP touching a boss this frame
+        self.peak_enemy_missiles = 0  # Most enemy missiles on screen at once
+        if self.telemetry is not None:
+            self._event(telemetry.GAME_START, self.plane, seed)
+
+    def snapshot(self) -> Snapshot:
+        """
+        Return the state of the game, to go back to it with restore(). It
+        holds every value that the coming frames depend on, down to the
+        order of the sprites and the random numbers, but no surfaces. The
+        counters of the pools are not part of it.
+        """
+        self.bind()
+        kinds = SPRITE_KINDS
+        all_sprites = self.allsprites.sprites()
+        return Snapshot(
+            self._snapshot_values(self) + (sprites.Enemy.initial_hp, sprites.Boss.initial_hp),
+            self.rng.getstate(),
+            ''.join([kinds[type(sprite)] for sprite in all_sprites]),
+            tuple([sprite.snapshot() for sprite in all_sprites]),
+            self.bullet_field.snapshot() if self.bullet_field is not None else None)
+
+    def restore(self, snapshot: Snapshot):
+        """
+        Go back to the state of 'snapshot', taken from this state or from one
+        made with the same settings. Its enemies and bosses are reused and
+        the other sprites are taken from the pools, past their caps if the
+        snapshot holds more. A renderer drawing the state should be reset
+        afterwards.
+        """
+        self.bind()
+        values = snapshot.values
+        for name, value in zip(self.SNAPSHOT_ATTRIBUTES, values):
+            setattr(self, name, value)
+        sprites.Enemy.initial_hp, sprites.Boss.initial_hp = values[-2:]
+
+        spare_enemies = self.enemies.sprites()
+        spare_bosses = self.bosses.sprites()
+        self.allsprites.empty()
+        self.enemies.empty()
+        self.bosses.empty()
+        for pool in self.pools.values():
+            pool.release_all()
+        pools = {SPRITE_KINDS[pooled_class]: pool for pooled_class, pool in self.pools.items()}
+        single = {'p': self.plane, 'u': self.powerup, 'h': self.hp_pack}
+        restored = []
+        for kind, sprite_values in zip(snapshot.kinds, snapshot.sprites):
+            if kind in single:
+                sprite = single[kind]
+            elif kind == 'e':
+                sprite = spare_enemies.pop() if spare_enemies else sprites.Enemy()
+                self.enemies.add(sprite)
+            elif kind == 'b':
+                sprite = spare_bosses.pop() if spare_bosses else sprites.Boss()
+                self.bosses.add(sprite)
+            else:
+                sprite = pools[kind].acquire(force=True)
+            sprite.restore(sprite_values)
+            restored.append(sprite)
+        self.allsprites.add(*restored)
+        if self.bullet_field is not None:
+            self.bullet_field.restore(snapshot.bullets)
+
+        # Last, since new enemies and bosses draw random numbers
+        self.rng.setstate(snapshot.rng)
+
+    @property
+    def bosses_killed(self) -> int:
+        """Number of bosses defeated in this game"""
+        return self.boss_number_appear - 1
+
+    def enemy_missile_centers(self) -> List[Tuple[int, int]]:
+        """Return the centers of all enemy missiles on screen."""
+        centers = [missile.rect.center for missile in self.pools[sprites.EnemyMissile].active]
+        field = self.bullet_field
+        if field is not None and field.count:
+            offset = (field.width // 2, field.height // 2)
+            centers.extend(map(tuple, (field.positions() + offset).astype(int).tolist()))
+        return centers
+
+    def step(self, buttons: int = 0) -> bool:
+        """
+        Advance the game by one frame with the arrow buttons in the mask
+        'buttons' held down (see the inputs module). Return False, and set
+        'game_over', once the plane is destroyed.
+
+        A frame runs the phases begin_frame() and spawn(), then collide() and
+        move() once for each of the 'substeps' steps of the frame, then
+        update(). The phases can also be called one by one, e.g. to time them.
+        """
+        self.begin_frame(buttons)
+        self.spawn()
+        for _ in range(self.substeps):
+            self.collide()
+
+            # End the game if the HP goes to 0
+            if self.plane.hp <= 0:
+                self.end()
+                return False
+
+            self.move()
+        self.update()
+        return True
+
+    def end(self):
+        """Mark the game as over, once the plane is destroyed."""
+        self.game_over = True
+        if self.telemetry is not None:
+            self._event(telemetry.GAME_OVER, self.plane, self.score)
+
+    def _event(self, kind: int, sprite, value: float = 0.0):
+        """Log an event of 'kind' about 'sprite' to the telemetry."""
+        x, y = sprite.rect.center
+        self.telemetry.log(kind, SPRITE_KINDS[type(sprite)], self.session, self.frame,
+                           x, y, value)
+
+    def begin_frame(self, buttons: int = 0):
+        """Start a new frame and tell the plane to move according to 'buttons'."""
+        self.bind()
+        self.frame += 1  # Loop counter
+        self.score += 1/30
+        self.boss_contact = False
+        self.plane.steer(buttons)
+
+    def spawn(self):
+        """Let the plane, enemies and bosses fire and new items, enemies and bosses appear."""
+        plane = self.plane
+        allsprites = self.allsprites
+        enemies = self.enemies
+        bosses = self.bosses
+        powerup = self.powerup
+        hp_pack = self.hp_pack
+        frame = self.frame
+
+        # The plane fires every constant period (frames)
+        if not frame % self.fire_period:
+            plane.fire()
+
+        # Randomly put a powerup item on the top of the screen if it is not
+        # already on the screen
+        if powerup not in allsprites and self.rng.random() <= main.POWER_UP_PROB:
+            powerup.appear()
+
+        # Randomly put a HP pack item on the top of the screen if it is not
+        # already on the screen
+        if hp_pack not in allsprites and self.rng.random() <= main.HP_PACK_PROB:
+            hp_pack.appear()
+
+        # Enemy's appearnce
+        if not frame % 100:
+            if len(bosses) == 0:
+                new_enemy = sprites.Enemy()
+                new_enemy.number_appear = self.boss_number_appear % 5
+                new_enemy.appearnce() # determine the image it appears
+
+                if self.mark: # enemy's hp increases since player has entered next level
+                    new_enemy.revival()
+                    self.mark = False
+                new_enemy.add(allsprites, enemies)
+                if self.telemetry is not None:
+                    self._event(telemetry.SPAWN, new_enemy)
+
+        # Enemy fires missile
+        for a_enemy in enemies:
+            a_enemy.fire()
+
+        # Another boss appears 25 seconds after the previous one is defeated
+        if frame == self.frame_record + 1500:
+            new_boss = sprites.Boss()
+            new_boss.number_appear = self.boss_number_appear % 5
+            new_boss.appearnce() # determine the image it appears
+
+            if not self.initial_boss_appear: # Boss has already appeared more than 1 time
+                new_boss.revival() # boss' hp increases
+            new_boss.add(allsprites, bosses)
+            if self.telemetry is not None:
+                self._event(telemetry.SPAWN, new_boss)
+
+        # Boss fires missile
+        if not frame % self.boss_fire_period:
+            for a_boss in bosses:
+                a_boss.fire()
+
+    def collide(self):
+        """
+        Check every collision and apply the damage, pickups and score. Damage
+        that lasts as long as two sprites touch is split over the substeps.
+        """
+        plane = self.plane
+        allsprites = self.allsprites
+        enemies = self.enemies
+        bosses = self.bosses
+        powerup = self.powerup
+        hp_pack = self.hp_pack
+        bullet_field = self.bullet_field
+        missile_grid = self.missile_grid
+        # Sprites collide when their circles overlap, and with 'mask' their
+        # opaque pixels must touch too
+        pixel = self.collisions == 'mask'
+        collide = collision.collide_mask if pixel else pygame.sprite.collide_circle
+        grid_collide = missile_grid.collide_mask if pixel else missile_grid.collide_circle
+        logging = self.telemetry is not None
+
+        # Increase missiles fired at once if collided with powerup item
+        if powerup in allsprites and pygame.sprite.collide_rect(plane, powerup):
+            plane.powerup()
+            powerup.kill()
+            if logging:
+                self._event(telemetry.PICKUP, powerup, plane.hp)
+
+        # Recover HP if collided with HP pack item
+        if hp_pack in allsprites and pygame.sprite.collide_rect(plane, hp_pack):
+            plane.hp += main.HP_INCREMENT
+            hp_pack.kill()
+            if logging:
+                self._event(telemetry.PICKUP, hp_pack, plane.hp)
+
+        # Check if enemy collide with our plane
+        for a_enemy in enemies:
+            if collide(plane, a_enemy):
+                plane.hp -= main.COLLIDE_HP_DROP
+                plane.remove_powerup()
+                a_enemy.kill()
+                if logging:
+                    self._event(telemetry.HIT, a_enemy, plane.hp)
+
+        # Check if enemy's missile hit our plane
+        if bullet_field is not None:
+            if pixel:
+                hits = bullet_field.collide_mask(plane, main.image_mask(plane.image))
+            else:
+                hits = bullet_field.collide_circle(plane)
+            if hits:
+                plane.hp -= main.HIT_HP_DROP * hits
+                plane.remove_powerup()
+                if logging:
+                    x, y = plane.rect.center
+                    for _ in range(hits):
+                        self.telemetry.log(telemetry.HIT, 'n', self.session, self.frame,
+                                           x, y, plane.hp)
+        # There can be hundreds of them, so the circle test is called directly
+        for missile in sprites.EnemyMissile.active:
+            if (pygame.sprite.collide_circle(plane, missile)
+                    and (not pixel or collision.masks_overlap(plane, missile))):
+                missile.recycle()
+                plane.hp -= main.HIT_HP_DROP
+                plane.remove_powerup()
+                if logging:
+                    self._event(telemetry.HIT, missile, plane.hp)
+
+        # Check if our plane's missile hit enemy. Only the missiles near
+        # each enemy are tested, and a recycled one is taken off the grid.
+        missile_grid.rebuild(sprites.Missile.active)
+        for a_enemy in enemies:
+            for missile in grid_collide(a_enemy):
+                missile.recycle()
+                missile_grid.remove(missile)
+                a_enemy.hp -= main.HIT_HP_DROP
+            if a_enemy.hp <= 0:
+                self.score += 40
+                a_enemy.die()
+                if logging:
+                    self._event(telemetry.KILL, a_enemy, self.score)
+
+        # Check if boss collide with our plane. The contact costs HP once a
+        # frame, however many substeps it lasts, so that HP stays whole.
+        for a_boss in bosses:
+            if collide(plane, a_boss) and not self.boss_contact:
+                self.boss_contact = True
+                plane.hp -= main.COLLIDE_HP_DROP
+                plane.remove_powerup()
+                if logging:
+                    self._event(telemetry.HIT, a_boss, plane.hp)
+
+        # Check if our plane's missile hit boss
+        for a_boss in bosses:
+            for missile in grid_collide(a_boss):
+                missile.recycle()
+                missile_grid.remove(missile)
+                a_boss.hp -= main.HIT_HP_DROP
+            if a_boss.hp <= 0:
+                self.score += 200
+                a_boss.die()
+                if logging:
+                    self._event(telemetry.BOSS_DEATH, a_boss, self.boss_number_appear)
+                self.mark = True # player entering next level
+                self.initial_boss_appear = False # launch revival method every time a new boss appears
+                self.boss_number_appear += 1
+                self.frame_record = self.frame # to record the number of frames when a boss is defeated
+
+    def move(self):
+        """Move every sprite by one substep."""
+        dt = 1 / self.substeps
+        if self.bullet_field is not None:
+            self.bullet_field.move(dt)
+        for sprite in self.allsprites.sprites():
+            sprite.move(dt)
+
+    def update(self):
+        """Let every sprite turn, fire or leave the screen after the frame's moves."""
+        if self.bullet_field is not None:
+            self.bullet_field.update(sprites.OFFSCREEN_MARGIN)
+        self.allsprites.update()
+
+        enemy_missiles = sprites.EnemyMissile.population()
+        if enemy_missiles > self.peak_enemy_missiles:
+            self.peak_enemy_missiles = enemy_missiles
+
+
+def play(state: GameState, input_provider, max_frames: int = None) -> int:
+    """
+    Advance 'state' with the buttons returned by 'input_provider' until the
+    game is over or 'max_frames' frames have been played. Return the number
+    of frames played.
+    """
+    while state.frame != max_frames and state.step(input_provider()):
+        pass
+    return state.frame
@@ -0,0 +1,115 @@
+"""
+This module keeps images already decoded and scaled to their size in the
+game in a cache directory, as raw RGB pixels. Reading them back needs no
+decoding and no resampling (see main._read_image and atlas.read). Nothing
+here needs the display, so it can run in any thread.
+
+Each entry is one file named after the source path, the parameters it was
+loaded with and the pygame version. It records the modification time, size
+and SHA-1 of the source file: an entry whose source has another time or size
+is checked against the hash, and is replaced if the content changed.
+"""
+import hashlib
+import os
+from pathlib import Path
+import struct
+from typing import Callable, Optional, Tuple
+import pygame
+
+
+VERSION = 1  # Bumped when the format changes, which moves to a new directory
+MAGIC = b'PBCI'
+# Magic, width, height, whether there is a colorkey, colorkey, source
+# modification time in ns, source size and SHA-1 of the source
+HEADER = struct.Struct('<4sHH?3BqQ20s')
+
+
+def _entry_path(directory: Path, source: Path, params: tuple) -> Path:
+    """Return the cache file of 'source' loaded with 'params'."""
+    key = repr((str(source), params, pygame.version.ver)).encode()
+    return Path(directory) / ('v%d' % VERSION) / (hashlib.sha1(key).hexdigest() + '.raw')
+
+
+def _hash(path: Path) -> bytes:
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+def read(entry: Path, source: Path) -> Optional[pygame.Surface]:
+    """
+    Return the surface cached in the file 'entry' if it is still the one of
+    'source', else None. The surface is not converted to the display format.
+    """
+    try:
+        with open(entry, 'rb') as file:
+            data = file.read()
+        stat = source.stat()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    (magic, width, height, has_colorkey, red, green, blue,
+     mtime, size, digest) = HEADER.unpack_from(data)
+    if magic != MAGIC or len(data) != HEADER.size + 3 * width * height:
+        return None
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        if _hash(source) != digest:
+            return None
+        # Same content with a new time, as after a checkout: record the time
+        # so that the source is not hashed again
+        try:
+            _write(entry, source, data[HEADER.size:], (width, height),
+                   (red, green, blue) if has_colorkey else None, digest)
+        except OSError:
+            pass
+    image = pygame.image.fromstring(data[HEADER.size:], (width, height), 'RGB')
+    if has_colorkey:
+        image.set_colorkey((red, green, blue))
+    return image
+
+
+def write_file(path: Path, data: bytes):
+    """
+    Write 'data' to the file 'path' under a temporary name and then rename
+    it, so that another process never reads half of it.
+    """
+    path = Path(path)
+    temporary = path.with_name('%s.%d%s' % (path.stem, os.getpid(), path.suffix))
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+def write(entry: Path, source: Path, image: pygame.Surface):
+    """Save 'image', loaded from 'source', to the file 'entry' (see write_file())."""
+    _write(entry, source, pygame.image.tostring(image, 'RGB'), image.get_size(),
+           image.get_colorkey())
+
+
+def _write(entry: Path, source: Path, pixels: bytes, size: Tuple[int, int],
+           colorkey: Optional[tuple], digest: bytes = None):
+    stat = source.stat()
+    header = HEADER.pack(MAGIC, size[0], size[1], colorkey is not None,
+                         *(colorkey[:3] if colorkey is not None else (0, 0, 0)),
+                         stat.st_mtime_ns, stat.st_size, digest or _hash(source))
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    write_file(entry, header + pixels)
+
+
+def load(directory: Path, source: Path, params: tuple,
+         decode: Callable[[], pygame.Surface]) -> pygame.Surface:
+    """
+    Return the image of the file 'source' loaded with 'params' from the cache
+    in 'directory'. If it is not cached or out of date, call 'decode' for it
+    and cache what it returns.
+    """
+    source = Path(source)
+    entry = _entry_path(directory, source, params)
+    image = read(entry, source)
+    if image is None:
+        image = decode()
+        try:
+            write(entry, source, image)
+        except (OSError, pygame.error) as error:
+            print('Warning: cannot cache image %s: %s' % (source.name, error))
+    return image
@@ -0,0 +1,221 @@
+"""
+This module provides the input that steers the plane. Input is a bit mask
+of the arrow buttons held down in a frame, so any source (the keyboard, a
+bot, a recording) can drive the game.
+"""
+import random
+import struct
+import pygame
+
+
+# Bits of the button mask
+LEFT = 1
+RIGHT = 2
+UP = 4
+DOWN = 8
+
+
+def from_keys(keys_pressed) -> int:
+    """Convert the result of pygame.key.get_pressed() into a button mask."""
+    buttons = 0
+    if keys_pressed[pygame.K_LEFT]:
+        buttons |= LEFT
+    if keys_pressed[pygame.K_RIGHT]:
+        buttons |= RIGHT
+    if keys_pressed[pygame.K_UP]:
+        buttons |= UP
+    if keys_pressed[pygame.K_DOWN]:
+        buttons |= DOWN
+    return buttons
+
+
+class Recording:
+    """
+    The seed and the buttons of every frame of one game, which is all it
+    takes to play the game again exactly (see game.GameState) with the same
+    number of substeps per frame and the same collisions, 'circle' or
+    'mask' with masks grown by 'mask_margin' (see main.image_mask). The
+    final score is kept to check that a replay did not diverge.
+
+    On disk, a header is followed by the buttons run-length encoded, one byte
+    per run: the low 4 bits are the button mask and the high 4 bits the run
+    length minus one. Recordings of version 2, which had no collisions in
+    the header, were all played with circle collisions, and those of
+    version 3, which had no mask margin, with masks not grown.
+    """
+    MAGIC = b'PBCR'
+    VERSION = 4
+    # Magic, version, seed, frames, score, substeps, whether collisions are
+    # 'mask' and the mask margin
+    HEADER = struct.Struct('<4sBqIIB?B')
+    HEADER_V3 = struct.Struct('<4sBqIIB?')
+    HEADER_V2 = struct.Struct('<4sBqIIB')
+
+    def __init__(self, seed: int, buttons: bytes = b'', score: int = 0, substeps: int = 1,
+                 collisions: str = 'circle', mask_margin: int = 0):
+        self.seed = seed
+        self.buttons = bytearray(buttons)  # One button mask per frame
+        self.score = score
+        self.substeps = substeps
+        self.collisions = collisions
+        self.mask_margin = mask_margin
+
+    def __len__(self):
+        return len(self.buttons)
+
+    def to_bytes(self) -> bytes:
+        """Encode the recording in the file format."""
+        runs = bytearray()
+        buttons = self.buttons
+        i = 0
+        while i < len(buttons):
+            mask = buttons[i]
+            length = 1
+            while length < 16 and i + length < len(buttons) and buttons[i + length] == mask:
+                length += 1
+            runs.append((length - 1) << 4 | mask)
+            i += length
+        return self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, len(buttons), self.score,
+                                self.substeps, self.collisions == 'mask',
+                                self.mask_margin) + bytes(runs)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Recording':
+        """Decode a recording from the file format."""
+        magic, version = struct.unpack_from('<4sB', data)
+        if magic != cls.MAGIC or version not in (2, 3, cls.VERSION):
+            raise ValueError('Not a recording of this version')
+        mask_margin = 0
+        if version == 2:
+            header = cls.HEADER_V2
+            _, _, seed, frames, score, substeps = header.unpack_from(data)
+            pixel = False
+        elif version == 3:
+            header = cls.HEADER_V3
+            _, _, seed, frames, score, substeps, pixel = header.unpack_from(data)
+        else:
+            header = cls.HEADER
+            _, _, seed, frames, score, substeps, pixel, mask_margin = header.unpack_from(data)
+        buttons = bytearray()
+        for run in data[header.size:]:
+            buttons.extend(bytes((run & 15,)) * ((run >> 4) + 1))
+        if len(buttons) != frames:
+            raise ValueError('Recording is truncated')
+        return cls(seed, buttons, score, substeps, 'mask' if pixel else 'circle', mask_margin)
+
+    def save(self, path):
+        """Write the recording to the file 'path'."""
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path) -> 'Recording':
+        """Read a recording from the file 'path'."""
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+class RecordingInput:
+    """Pass on the buttons of 'provider' and append them to 'recording'."""
+    def __init__(self, provider, recording: Recording):
+        self.provider = provider
+        self.recording = recording
+
+    def __call__(self) -> int:
+        buttons = self.provider()
+        self.recording.buttons.append(buttons)
+        return buttons
+
+
+class ReplayInput:
+    """Give the buttons of 'recording' frame by frame."""
+    def __init__(self, recording: Recording):
+        self.buttons = recording.buttons
+        self.frame = 0
+
+    def __call__(self) -> int:
+        buttons = self.buttons[self.frame]
+        self.frame += 1
+        return buttons
+
+
+class KeyboardInput:
+    """Read the arrow keys of the keyboard."""
+    def __call__(self) -> int:
+        return from_keys(pygame.key.get_pressed())
+
+
+class RandomInput:
+    """
+    Hold a random combination of buttons for a random number of frames, up
+    to 'max_hold', then pick another one.
+    """
+    def __init__(self, seed: int = None, max_hold: int = 30):
+        self.random = random.Random(seed)
+        self.max_hold = max_hold
+        self.buttons = 0
+        self.hold = 0
+
+    def __call__(self) -> int:
+        if self.hold <= 0:
+            self.buttons = self.random.randrange(16)
+            self.hold = self.random.randint(1, self.max_hold)
+        self.hold -= 1
+        return self.buttons
+
+
+class DodgeBot:
+    """
+    Scripted player for a game.GameState. It moves away from the enemy
+    missiles and enemies closer than 'danger_radius'. When nothing is close,
+    it lines up under the nearest enemy or boss to shoot it and goes back
+    to the height 'home_y'.
+    """
+    def __init__(self, state, danger_radius: float = 90, home_y: int = 560):
+        self.state = state
+        self.danger_radius = danger_radius
+        self.home_y = home_y
+
+    def __call__(self) -> int:
+        state = self.state
+        x, y = state.plane.rect.center
+        threats = state.enemy_missile_centers()
+        threats.extend(enemy.rect.center for enemy in state.enemies)
+        threats.extend(boss.rect.center for boss in state.bosses)
+
+        # Sum the pushes away from each close threat, stronger when closer
+        push_x = push_y = 0.0
+        limit = self.danger_radius ** 2
+        for threat_x, threat_y in threats:
+            dx = x - threat_x
+            dy = y - threat_y
+            distance = dx * dx + dy * dy
+            if distance < limit:
+                push_x += dx / (distance + 1)
+                push_y += dy / (distance + 1)
+
+        buttons = 0
+        if push_x or push_y:
+            if push_x < 0:
+                buttons |= LEFT
+            elif push_x > 0:
+                buttons |= RIGHT
+            if push_y < 0:
+                buttons |= UP
+            elif push_y > 0:
+                buttons |= DOWN
+            return buttons
+
+        targets = [sprite.rect.centerx for sprite in state.bosses] \
+            or [sprite.rect.centerx for sprite in state.enemies]
+        if targets:
+            target = min(targets, key=lambda target_x: abs(target_x - x))
+            if target < x - 4:
+                buttons |= LEFT
+            elif target > x + 4:
+                buttons |= RIGHT
+        if y < self.home_y - 4:
+            buttons |= DOWN
+        elif y > self.home_y + 4:
+            buttons |= UP
+        return buttons
@@ -0,0 +1,118 @@
+"""
+This module loads the images and sounds of the game in a worker thread, so
+that the window shows the start menu and the loading progress right away.
+The worker does the slow part, reading, decoding and scaling the files (see
+main._read_image), and the main thread converts each image to the display
+format, and makes the collision mask of a colorkeyed image, when it takes
+it in AssetLoader.poll().
+"""
+import queue
+import threading
+from typing import Tuple
+import pygame
+import atlas
+import main
+
+
+class AssetLoader:
+    """
+    Loads the images of 'manifest' into the image cache of main and the
+    sound effects named 'sounds', decoded whole by main.load_sound(), into
+    the dict 'sounds', in a worker thread started by start(). The images of
+    'first' are loaded before anything else, then the sounds, the atlas at
+    main.ATLAS_PATH and the images not in it.
+
+    Nothing is put in place until the main thread calls poll(). An error in
+    the worker, such as the SystemExit of a missing file, is raised again by
+    poll().
+    """
+    def __init__(self, manifest, first=(), sounds=()):
+        self.manifest = list(manifest)
+        self.first = list(first)
+        self.sound_names = list(sounds)
+        self.sounds = {}
+        # Images not in the image cache yet, and the number of everything loaded
+        self.pending = {main._image_key(*entry) for entry in self.first + self.manifest}
+        self.pending.difference_update(main._image_cache)
+        self.total = len(self.pending) + len(self.sound_names)
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self._work, name='AssetLoader', daemon=True)
+        self.done = False  # Whether poll() took in everything
+
+    def start(self):
+        """Start the worker thread."""
+        self.thread.start()
+
+    def _work(self):
+        put = self.results.put
+        try:
+            for name, colorkey, scale in self.first:
+                put(('image', main._image_key(name, colorkey, scale),
+                     main._read_image(name, colorkey, scale)))
+            for name in self.sound_names:
+                put(('sound', name, main.load_sound(name)))
+            in_atlas = set()
+            if main.ATLAS_PATH is not None:
+                surface, index = atlas.read_or_build(main.ATLAS_PATH, self.manifest)
+                put(('atlas', surface, index))
+                in_atlas = {main._image_key(entry['name'], entry['colorkey'], entry['scale'])
+                            for entry in index}
+            for name, colorkey, scale in self.manifest:
+                key = main._image_key(name, colorkey, scale)
+                if key in self.pending and key not in in_atlas:
+                    put(('image', key, main._read_image(name, colorkey, scale)))
+        except BaseException as error:
+            put(('error', error, None))
+        put(('done', None, None))
+
+    def poll(self) -> float:
+        """
+        Put in place what the worker loaded since the last call and return
+        the fraction of everything that is loaded.
+        """
+        while True:
+            try:
+                kind, first, second = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'image':
+                self._add(first, main._convert_image(second))
+            elif kind == 'atlas':
+                for key, image in atlas.cut(main._convert_image(first), second).items():
+                    self._add(key, image)
+            elif kind == 'sound':
+                self.sounds[first] = second
+            elif kind == 'error':
+                raise first
+            else:
+                self.done = True
+        return self.progress()
+
+    def _add(self, key: tuple, image: pygame.Surface):
+        if key not in main._image_cache:
+            main._image_cache_stats['misses'] += 1
+            main._image_cache[key] = image
+            if key[1] is not None:
+                main.image_mask(image)
+        self.pending.discard(key)
+
+    def progress(self) -> float:
+        """Return the fraction of the images and sounds that are loaded."""
+        if not self.total:
+            return 1.0
+        return 1 - (len(self.pending) + len(self.sound_names) - len(self.sounds)) / self.total
+
+    def ready(self, manifest) -> bool:
+        """Return whether every image of 'manifest' is in the image cache."""
+        return all(main._image_key(*entry) in main._image_cache for entry in manifest)
+
+
+def draw_progress(surface: pygame.Surface, fraction: float, rect: Tuple[int, int, int, int],
+                  color: Tuple[int, int, int] = (225, 225, 225)):
+    """Draw a bar filled to 'fraction' in 'rect'."""
+    rect = pygame.Rect(rect)
+    pygame.draw.rect(surface, color, rect, 1)
+    inner = rect.inflate(-4, -4)
+    inner.width = round(inner.width * fraction)
+    if inner.width > 0:
+        pygame.draw.rect(surface, color, inner)
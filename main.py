@@ -1,10 +1,19 @@
 """The main module of the game"""
 
+import argparse
 from pathlib import Path
-import random
+import time
 from typing import Tuple
 import pygame
+import atlas
+import game
+import imagecache
+import inputs
+import loading
+import profiling
+import render
 import sprites
+import telemetry
 
 
 # Constants to control gameplay and hardness
@@ -15,35 +24,230 @@ HP_PACK_PROB = 0.001
 POWER_UP_PROB = 0.001
 HIT_HP_DROP = 10
 COLLIDE_HP_DROP = 20
+# Game time runs in fixed frames of 1/FRAME_RATE s, which every period and
+# speed of the game counts in, however fast the display is drawn
+FRAME_RATE = 60
+STEP_RATE = 60  # Movement and collision steps per second, a multiple of FRAME_RATE
+RENDER_FPS = 60  # Most frames drawn per second, 0 for no limit
+MAX_FRAME_LAG = 0.25  # Seconds of game time caught up at most after a slow frame
+MENU_WAIT = 1000  # Longest time in ms a menu sleeps waiting for events
+LOADING_WAIT = 50  # Time in ms between progress updates of the start view while loading
+# Sprites created up front for each pool, and the cap of each pool (None: no cap)
+MISSILE_POOL_SIZE, MISSILE_POOL_MAX = 10, None
+ENEMY_MISSILE_POOL_SIZE, ENEMY_MISSILE_POOL_MAX = 10, None
+EXPLOSION_POOL_SIZE, EXPLOSION_POOL_MAX = 5, None
+COLLISION_CELL_SIZE = 64  # Side of a spatial hash cell in pixels
+# 'circle' for the circle collisions, or 'mask' to confirm each circle hit
+# with the opaque pixels of the two images (see collision.collide_mask)
+COLLISIONS = 'mask'
+# Pixels the collision masks are grown by all around, so that a missile
+# grazing the plane within twice this distance still hits. The plane's
+# circle is much larger than its swept wings, and without a margin the
+# masks let through most of the hits the circles count.
+MASK_MARGIN = 6
+ENEMY_MISSILE_BACKEND = 'sprite'  # 'sprite', or 'numpy' for bullets.BulletField
+RENDERER = 'full'  # 'full', or 'dirty' to update only the changed parts of the display
+DIRTY_AREA_THRESHOLD = 0.5  # Flip the whole display if more of it than this changed
+# Frames between background scrolls in dirty mode, 0 stops it. A scroll
+# changes every pixel, so only the frames in between update just the changed
+# rects. With 4, three frames out of four do, and the background moves in
+# steps of 4 * SCROLLING_SPEED pixels instead of smoothly.
+DIRTY_SCROLL_INTERVAL = 4
 IMG_DIR = Path(__file__).resolve().parent / 'img'
+ATLAS_PATH = IMG_DIR / 'atlas.png'  # Image atlas (see atlas.py), None to load every image on its own
+# Directory of the images already scaled to their size in the game (see
+# imagecache.py), None to decode every image file at startup
+IMG_CACHE_DIR = Path(__file__).resolve().parent / '.cache' / 'img'
 SOUND_DIR = Path(__file__).resolve().parent / 'sound'
+# Background music in SOUND_DIR, streamed from the first of MUSIC_FORMATS there is
+MUSIC = 'Africa'
+MUSIC_FORMATS = ('.ogg', '.mp3', '.wav')
+MUSIC_VOLUME = 0.05
+
+
+# Every image the game loads, as (name, colorkey, scale). preload_images()
+# walks this list once at startup so that nothing hits the disk in the loop.
+IMAGE_MANIFEST = (
+    [('background1.png', None, (480, 640)),
+     ('gameover.png', -1, (400, 150)),
+     ('bullet.png', -1, (5, 20)),
+     ('bullet_enemy.png', -1, (5, 21)),
+     ('powerup.png', -1, (25, 25)),
+     ('hp_pack.png', -1, (25, 25)),
+     ('enemy_ex.png', -1, (32, 34)),
+     ('enemy_ash.png', -1, (32, 34)),
+     ('enemy_ex.png', -1, (96, 102)),
+     ('enemy_ash.png', -1, (96, 102))]
+    + [(name, -1, (272, 81)) for name in ('start.png', 'start_down.png',
+                                          'game_again.png', 'game_again_down.png',
+                                          'leave_game.png', 'leave_game_down.png')]
+    + [('plane_lv{}.png'.format(i), -1, (64, 68)) for i in range(1, 4)]
+    + [('enemy{}.png'.format(i), -1, (32, 34)) for i in range(1, 6)]
+    + [('boss{}.png'.format(i), -1, (96, 102)) for i in range(1, 6)]
+)
+
+# The images of the start menu, loaded first so that it shows right away
+MENU_MANIFEST = (('background1.png', None, (480, 640)),
+                 ('start.png', -1, (272, 81)),
+                 ('start_down.png', -1, (272, 81)))
+
+# Converted surfaces shared by every caller, keyed by (name, colorkey, scale)
+_image_cache = {}
+_image_cache_stats = {'hits': 0, 'misses': 0}
+# Collision masks of the colorkeyed images of the cache, keyed by the surface
+# and the MASK_MARGIN they were grown by
+_mask_cache = {}
 
 
 # functions to create our resources
-def load_image(name, colorkey=None, scale: Tuple[int, int] = None):
+def _image_key(name, colorkey, scale):
+    """Normalize the arguments of load_image() into a hashable cache key."""
+    if colorkey is not None and colorkey != -1:
+        colorkey = tuple(colorkey)
+    if scale is not None:
+        scale = tuple(scale)
+    return name, colorkey, scale
+
+
+def _decode_image(name, colorkey=None, scale: Tuple[int, int] = None):
+    """Read the image file from disk, convert it and apply colorkey and scale."""
+    return _convert_image(_read_image(name, colorkey, scale))
+
+
+def _read_image(name, colorkey=None, scale: Tuple[int, int] = None) -> pygame.Surface:
     """
-    Search for image file with filename 'name' in the ./sound/ directory
-    and try to load it as a sound object.
+    Do the part of _decode_image() that does not need the display mode: the
+    image is decoded, given its colorkey and scaled, but kept in a 32 bit
+    format of its own until _convert_image(). It is taken from the cache in
+    IMG_CACHE_DIR if it is there. This can run in any thread once the
+    display is initialized (see loading.AssetLoader).
     """
     path = IMG_DIR / name
+    if IMG_CACHE_DIR is not None:
+        return imagecache.load(IMG_CACHE_DIR, path, _image_key(name, colorkey, scale)[1:],
+                               lambda: _read_image_file(path, colorkey, scale))
+    return _read_image_file(path, colorkey, scale)
+
+
+def _read_image_file(path: Path, colorkey=None, scale: Tuple[int, int] = None):
+    """Decode the image file at 'path' as _read_image() does, without the cache."""
     try:
         image = pygame.image.load(str(path))
     except pygame.error:
         print("Cannot load image:", path)
         raise SystemExit(str(pygame.compat.geterror()))
-    image = image.convert()
+    # Drop the alpha channel like convert() does, into the usual display format
+    image = image.convert(pygame.Surface((1, 1), 0, 32))
     if colorkey is not None:
         if colorkey == -1:
             colorkey = image.get_at((0, 0))
         image.set_colorkey(colorkey, pygame.RLEACCEL)
     if scale is not None:
         image = pygame.transform.scale(image, scale)
+    return image
+
+
+def _convert_image(image: pygame.Surface) -> pygame.Surface:
+    """Convert an image of _read_image() to the format of the display."""
+    colorkey = image.get_colorkey()
+    image = image.convert()
+    if colorkey is not None:
+        image.set_colorkey(colorkey, pygame.RLEACCEL)
+    return image
+
+
+def load_image(name, colorkey=None, scale: Tuple[int, int] = None):
+    """
+    Search for image file with filename 'name' in the ./img/ directory and
+    return it as a converted surface together with a new rect of its size.
+
+    Surfaces are cached per (name, colorkey, scale), so every caller asking
+    for the same image shares one surface and only the first call reads the
+    disk. Callers must not draw on the returned surface.
+    """
+    key = _image_key(name, colorkey, scale)
+    image = _image_cache.get(key)
+    if image is None:
+        _image_cache_stats['misses'] += 1
+        image = _image_cache[key] = _decode_image(name, colorkey, scale)
+    else:
+        _image_cache_stats['hits'] += 1
     return image, image.get_rect()
 
 
+def preload_images(manifest=IMAGE_MANIFEST):
+    """
+    Load every (name, colorkey, scale) entry of 'manifest' into the image
+    cache, and make the collision masks of the colorkeyed ones. Needs the
+    display mode to be set, because images are converted.
+
+    The images packed in the atlas at ATLAS_PATH are cut out of it, which
+    is built first if needed, and only the others are read one by one.
+    """
+    if ATLAS_PATH is not None:
+        for key, image in atlas.load_or_build(ATLAS_PATH, manifest).items():
+            if key not in _image_cache:
+                _image_cache[key] = image
+    for name, colorkey, scale in manifest:
+        key = _image_key(name, colorkey, scale)
+        if key not in _image_cache:
+            _image_cache_stats['misses'] += 1
+            _image_cache[key] = _decode_image(name, colorkey, scale)
+    for (_, colorkey, _), image in _image_cache.items():
+        if colorkey is not None:
+            image_mask(image)
+
+
+def image_mask(image: pygame.Surface) -> pygame.mask.Mask:
+    """
+    Return the collision mask of 'image', its pixels not of the colorkey,
+    grown by MASK_MARGIN pixels all around. The top left corner of the mask
+    is then MASK_MARGIN pixels up and left of the image's, the same for
+    every mask, so two masks overlap at the offset between their images.
+    Masks are made once per surface and margin, so every image of the image
+    cache, which is one per (name, colorkey, scale), has a single one.
+    """
+    key = (image, MASK_MARGIN)
+    mask = _mask_cache.get(key)
+    if mask is None:
+        mask = pygame.mask.from_surface(image)
+        if MASK_MARGIN:
+            mask = mask.convolve(_disc_mask(MASK_MARGIN))
+        _mask_cache[key] = mask
+    return mask
+
+
+def _disc_mask(radius: int) -> pygame.mask.Mask:
+    """Return a mask of the pixels within 'radius' of its center pixel."""
+    size = 2 * radius + 1
+    disc = pygame.mask.Mask((size, size))
+    for x in range(size):
+        for y in range(size):
+            if (x - radius) ** 2 + (y - radius) ** 2 <= radius ** 2:
+                disc.set_at((x, y))
+    return disc
+
+
+def image_cache_stats() -> dict:
+    """Return the hit/miss counts, the number of surfaces and the bytes held."""
+    return {'hits': _image_cache_stats['hits'],
+            'misses': _image_cache_stats['misses'],
+            'images': len(_image_cache),
+            'bytes': sum(image.get_pitch() * image.get_height()
+                         for image in _image_cache.values())}
+
+
+def clear_image_cache():
+    """Drop all cached surfaces, e.g. after the display mode has changed."""
+    _image_cache.clear()
+    _mask_cache.clear()
+    _image_cache_stats['hits'] = 0
+    _image_cache_stats['misses'] = 0
+
+
 class NoneSound:
     """Dummy sound object for the case cannot import pygame mixer module"""
-    def play(self):
+    def play(self, loops: int = 0):
         pass
 
     def set_volume(self, i: float):
@@ -66,129 +270,252 @@ def load_sound(name: str) -> pygame.mixer.Sound:
     return sound
 
 
-def main():
-    """This is the main function."""
-    pygame.init()
+class Music:
+    """
+    Music streamed from the file at 'path' by pygame.mixer.music, which
+    decodes it bit by bit while it plays instead of all at once like a
+    Sound. Only one can be loaded at a time. Looping restarts the stream
+    without a gap, apart from the silence that MP3 encoders pad files with.
+    """
+    def __init__(self, path: Path):
+        pygame.mixer.music.load(str(path))
 
-    # Load background music
-    if not pygame.mixer:
-        print('Warning: Sound disabled')
-    music = load_sound('Africa.wav')
-    music.set_volume(0.05)
+    def play(self, loops: int = 0):
+        pygame.mixer.music.play(loops)
+
+    def set_volume(self, i: float):
+        pygame.mixer.music.set_volume(i)
+
+
+def load_music(name: str):
+    """
+    Search for the music 'name', without extension, in the ./sound/
+    directory in each format of MUSIC_FORMATS, and return it as a Music
+    ready to stream. Without mixer or music file, return a NoneSound.
+    """
+    if not pygame.mixer or not pygame.mixer.get_init():
+        return NoneSound()
+    for extension in MUSIC_FORMATS:
+        path = SOUND_DIR / (name + extension)
+        if path.exists():
+            try:
+                return Music(path)
+            except pygame.error as message:
+                print('Cannot load music:', path.name, message)
+    print('Warning: No music found for', name)
+    return NoneSound()
+
+
+def _wait_events(timeout: int) -> list:
+    """
+    Sleep until there is an event or for 'timeout' ms, and return the events
+    that came in.
+    """
+    event = pygame.event.wait(timeout)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
 
-    # Create pygame display window
-    screen = pygame.display.set_mode((480, 640))
-    pygame.display.set_caption('pbc fly')
 
+def create_view(screen: pygame.Surface):
+    """
+    Create a game state and the renderer chosen by RENDERER that draws it on
+    'screen'. Return both.
+    """
     # Load background image
-    background, _ = load_image('background1.png', scale=(480, 640))
-    background1_rect = pygame.Rect(0, 0, 480, 640)
-    background2_rect = pygame.Rect(0, 0, 480, 640)
+    background = render.ScrollingBackground(
+        load_image('background1.png', scale=(480, 640))[0], SCROLLING_SPEED)
 
     # Set the font of the score
     score_font = pygame.font.SysFont('arial', 25)
 
-    start_button = sprites.Button('start.png', 'start_down.png', (240, 320))
-    again_button = sprites.Button('game_again.png', 'game_again_down.png', (240, 390))
-    leave_button = sprites.Button('leave_game.png', 'leave_game_down.png', (240, 480))
-    gameover_image, _ = load_image('gameover.png', colorkey=-1, scale=(400, 150))
+    if RENDERER == 'dirty':
+        state = game.GameState(render.DirtyRenderer.group_class)
+        renderer = render.DirtyRenderer(screen, state, background, score_font,
+                                        DIRTY_AREA_THRESHOLD, DIRTY_SCROLL_INTERVAL)
+    else:
+        state = game.GameState(render.FullRenderer.group_class)
+        renderer = render.FullRenderer(screen, state, background, score_font)
+    return state, renderer
+
+
+def _game_seed(seed: int, number: int):
+    """Return the seed of game 'number' (counted from 1) of a session started with 'seed'."""
+    return None if seed is None else seed + number - 1
 
-    # Create sprites
-    plane = sprites.Plane()
-    allsprites = pygame.sprite.RenderPlain((plane))
-    # Create 10 missiles and store them in the class variable pool
-    sprites.Missile.pool = pygame.sprite.Group([sprites.Missile() for _ in range(10)])
-    sprites.Missile.allsprites = allsprites
-
-    # Create enemies
-    sprites.EnemyMissile.pool = pygame.sprite.Group([sprites.EnemyMissile() for _ in range(10)])
-    sprites.EnemyMissile.allsprites = allsprites
-    enemies = pygame.sprite.Group()
-    sprites.ExplosionEnemy.allsprites = allsprites
-    sprites.ExplosionBoss.allsprites = allsprites
-    sprites.Enemy.all_images = [load_image('enemy{}.png'.format(i),
-                                           colorkey=-1,
-                                           scale=(32, 34))[0] for i in range(1, 6)]
-
-    # Add boss group
-    bosses = pygame.sprite.Group()
-    sprites.Boss.all_images = [load_image('boss{}.png'.format(i),
-                                          colorkey=-1,
-                                          scale=(96, 102))[0] for i in range(1, 6)]
-
-    # Create falling objects
-    sprites.FallingItem.allsprites = allsprites
-    hp_pack = sprites.HpPack()
-    powerup = sprites.PowerUp()
-
-    # Create HP bar and let it track plane's hp attr
-    hp_bar = sprites.HpBar(plane)
+
+def _save_recording(recording: inputs.Recording, state, record: str,
+                    number: int):
+    """Save the recording of game 'number' to the path 'record'."""
+    recording.score = int(state.score)
+    recording.save(record.format(game=number))
+
+
+def main(headless: bool = False, input_provider=None, games: int = 1, max_frames: int = None,
+         seed: int = None, record: str = None, profile: str = None,
+         telemetry_path: str = None):
+    """
+    This is the main function.
+
+    In headless mode there is no window, sound or menu and the frame rate is
+    not capped: 'games' games are played back to back, each ending when the
+    plane is destroyed or after 'max_frames' frames, and the number of
+    simulated frames per second of wall-clock time is reported.
+    'input_provider' is a callable returning the button mask (see the inputs
+    module) for each frame. It defaults to the keyboard.
+
+    Game number n is seeded with 'seed' + n - 1, or randomly if 'seed' is
+    None. If 'record' is given, each game is saved as an inputs.Recording to
+    that path, where '{game}' is replaced by the game number.
+
+    F3 shows and hides the profiling overlay with the time of each phase of
+    the frame. If 'profile' is given, profiling is on from the start and the
+    timings of the last frames of each game are saved as CSV to that path,
+    where '{game}' is replaced by the game number.
+
+    If 'telemetry_path' is given, the events of the games and the time of
+    every drawn frame are logged to that file (see the telemetry module). A
+    window closed during a game leaves the log to be finished at exit.
+    """
+    if input_provider is None:
+        input_provider = inputs.KeyboardInput()
+    events = telemetry.Telemetry(telemetry_path) if telemetry_path else None
+
+    if headless:
+        game.setup_headless()
+        state = game.GameState()
+        state.telemetry = events
+        total_frames = 0
+        start_time = time.perf_counter()
+        for number in range(1, games + 1):
+            state.reset(_game_seed(seed, number))
+            provider = input_provider
+            if record:
+                recording = inputs.Recording(state.seed, substeps=state.substeps,
+                                             collisions=state.collisions,
+                                         mask_margin=MASK_MARGIN)
+                provider = inputs.RecordingInput(input_provider, recording)
+            if profile:
+                profiler = profiling.FrameProfiler(state)
+                total_frames += profiling.play(state, provider, max_frames, profiler)
+                profiler.write_csv(profile.format(game=number))
+            else:
+                total_frames += game.play(state, provider, max_frames)
+            if record:
+                _save_recording(recording, state, record, number)
+            print('Game %d: %d frames, score %d' % (number, state.frame, state.score))
+        elapsed = time.perf_counter() - start_time
+        print('%d frames in %.2f s, %.0f frames/s' % (total_frames, elapsed,
+                                                     total_frames / elapsed))
+        if events is not None:
+            events.close()
+            print(events.line())
+        pygame.quit()
+        return
+
+    pygame.init()
+    if not pygame.mixer:
+        print('Warning: Sound disabled')
+
+    # Create pygame display window
+    screen = pygame.display.set_mode((480, 640))
+    pygame.display.set_caption('pbc fly')
+
+    # Decode every image once, so that pool growth never reads the disk, in
+    # a worker thread while the start view is shown
+    loader = loading.AssetLoader(IMAGE_MANIFEST, MENU_MANIFEST)
+    loader.start()
+    start_button = None
+    starting = False
 
     # Create the clock object
     clock = pygame.time.Clock()
 
+    music = load_music(MUSIC)
+    music.set_volume(MUSIC_VOLUME)
     music.play(loops=-1)  # Looping play background music
 
-    # Enter starting view
+    # Enter starting view. The game starts once the start button was pressed
+    # and everything is loaded. The view sleeps waiting for events, waking
+    # up now and then while loading, and is drawn again only if it changed
+    menu_meter = profiling.CpuMeter('start menu')
+    dirty = True
+    shown_progress = None
     while True:
-        clock.tick(60)  # Max FPS = 60
-        # Event handling (somehow this needs to be here to make get the mouse position work)
-        for event in pygame.event.get():
+        progress = loader.poll()
+        if start_button is None and loader.ready(MENU_MANIFEST):
+            menu_background = render.ScrollingBackground(
+                load_image('background1.png', scale=(480, 640))[0], SCROLLING_SPEED)
+            start_button = sprites.Button('start.png', 'start_down.png', (240, 320))
+            dirty = True
+        if start_button is not None and start_button.pressed:
+            start_button.pressed = False
+            starting = True
+        if starting and loader.done:
+            break
+
+        if dirty or shown_progress != (progress, loader.done):
+            if start_button is None:
+                screen.fill((0, 0, 0))
+            else:
+                menu_background.draw(screen)
+                start_button.render(screen)
+            if not loader.done:
+                loading.draw_progress(screen, progress, (90, 600, 300, 12))
+            pygame.display.update()
+            menu_meter.redraws += 1
+            dirty = False
+            shown_progress = (progress, loader.done)
+
+        for event in _wait_events(MENU_WAIT if loader.done else LOADING_WAIT):
             if event.type == pygame.QUIT:
                 pygame.quit()
                 return
             if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                 pygame.quit()
                 return
-        screen.blit(background, (0, background1_rect.y))
-        screen.blit(background, (0, background2_rect.y))
-        start_button.render(screen)
-        if start_button.pressed:
-            start_button.pressed = False
-            break
-        pygame.display.update()
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                dirty = True
+            elif start_button is not None and start_button.handle(event):
+                dirty = True
+        menu_meter.wakeups += 1
+    menu_meter.stop()
+
+    again_button = sprites.Button('game_again.png', 'game_again_down.png', (240, 390))
+    leave_button = sprites.Button('leave_game.png', 'leave_game_down.png', (240, 480))
+    gameover_image, _ = load_image('gameover.png', colorkey=-1, scale=(400, 150))
+
+    # Create the game and the renderer that draws it
+    state, renderer = create_view(screen)
+    state.telemetry = events
+    background = renderer.background
+    profiler = profiling.FrameProfiler(state)
+    profiler.menus.append(menu_meter)
+    if profile:
+        renderer.profiler = profiler
+        print(menu_meter.line())
 
     keep_playing = True
-    game = 0
+    number = 0
     while keep_playing:
-        game += 1
-
-        # Re-position the plane
-        plane.place_at_bottom_center()
-
-        # Clearing the view by emptying all the groups
-        allsprites.empty()
-        allsprites.add(plane)
-        bosses.empty()
-        enemies.empty()
-        # Also empty those 'active' groups to avoid invisible missiles collide
-        # with our plane or enemies
-        sprites.Missile.pool.add(sprites.Missile.active)
-        sprites.Missile.active.empty()
-        sprites.EnemyMissile.pool.add(sprites.EnemyMissile.active)
-        sprites.EnemyMissile.active.empty()
-
-        # Reinitialize the HP and battle constant values of all class and objects
-        plane.hp = INITIAL_HP
-        sprites.Enemy.initial_hp = sprites.HP_ENEMY
-        sprites.Boss.initial_hp = sprites.HP_BOSS
-        fire_period = 20
-        boss_fire_period = 70
-
-        mark = False # to identify whether enemy adds hp after 1 boss is defeated (enemy level up)
-        initial_boss_appear = True # to identify the first appearance of boss
-        boss_number_appear = 1 # the number of boss that has appeared including this one
-
-        # Reinitialize loop counter and scores
-        score = 0
-        frame = 0
-        frame_record = 0
-
-        # Enter the main game loop
+        number += 1
+        state.reset(_game_seed(seed, number))
+        renderer.reset()
+        profiler.reset()
+        provider = input_provider
+        if record:
+            recording = inputs.Recording(state.seed, substeps=state.substeps,
+                                         collisions=state.collisions,
+                                         mask_margin=MASK_MARGIN)
+            provider = inputs.RecordingInput(input_provider, recording)
+
+        # Enter the main game loop. Each pass plays the game frames that
+        # became due since the previous one, then draws the result once.
+        frame_time = 1 / FRAME_RATE
+        lag = 0.0
+        last_time = time.perf_counter()
         while True:
-            frame += 1  # Loop counter
-            score += 1/30
-            clock.tick(60)  # Max FPS = 60
+            clock.tick(RENDER_FPS)
 
             # Event handling
             for event in pygame.event.get():
@@ -198,149 +525,57 @@ def main():
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                     pygame.quit()
                     return
-
-            # Check if arrow key is pressed, and tell the plane to move
-            plane.key_pressed()
-
-            # The plane fires every constant period (frames)
-            if not frame % fire_period:
-                plane.fire()
-
-            # Randomly put a powerup item on the top of the screen if it is not
-            # already on the screen
-            if powerup not in allsprites and random.random() <= POWER_UP_PROB:
-                powerup.appear()
-
-            # Randomly put a HP pack item on the top of the screen if it is not
-            # already on the screen
-            if hp_pack not in allsprites and random.random() <= HP_PACK_PROB:
-                hp_pack.appear()
-
-            # Enemy's appearnce
-            if not frame % 100:
-                if len(bosses) == 0:
-                    new_enemy = sprites.Enemy()
-                    new_enemy.number_appear = boss_number_appear % 5
-                    new_enemy.appearnce() # determine the image it appears
-
-                    if mark: # enemy's hp increases since player has entered next level
-                        new_enemy.revival()
-                        mark = False
-                    new_enemy.add(allsprites, enemies)
-
-            # Enemy fires missile
-            for a_enemy in enemies:
-                a_enemy.fire()
-
-            # Increase missiles fired at once if collided with powerup item
-            if powerup in allsprites and pygame.sprite.collide_rect(plane, powerup):
-                plane.powerup()
-                powerup.kill()
-
-            # Recover HP if collided with HP pack item
-            if hp_pack in allsprites and pygame.sprite.collide_rect(plane, hp_pack):
-                plane.hp += HP_INCREMENT
-                hp_pack.kill()
-
-            # Another boss appears 25 seconds after the previous one is defeated
-            if frame == frame_record + 1500:
-                new_boss = sprites.Boss()
-                new_boss.number_appear = boss_number_appear % 5
-                new_boss.appearnce() # determine the image it appears
-
-                if not initial_boss_appear: # Boss has already appeared more than 1 time
-                    new_boss.revival() # boss' hp increases
-                new_boss.add(allsprites, bosses)
-
-            # Boss fires missile
-            if not frame % boss_fire_period:
-                for a_boss in bosses:
-                    a_boss.fire()
-
-            # Check if enemy collide with our plane
-            for a_enemy in enemies:
-                if pygame.sprite.collide_circle(plane, a_enemy):
-                    plane.hp -= COLLIDE_HP_DROP
-                    plane.remove_powerup()
-                    a_enemy.kill()
-
-            # Check if enemy's missile hit our plane
-            for missile in sprites.EnemyMissile.active:
-                if pygame.sprite.collide_circle(plane, missile):
-                    missile.recycle()
-                    plane.hp -= HIT_HP_DROP
-                    plane.remove_powerup()
-
-            # Check if our plane's missile hit enemy
-            for a_enemy in enemies:
-                for missile in sprites.Missile.active:
-                    if pygame.sprite.collide_circle(a_enemy, missile):
-                        missile.recycle()
-                        a_enemy.hp -= HIT_HP_DROP
-                if a_enemy.hp <= 0:
-                    score += 40
-
-            # Check if boss collide with our plane
-            for a_boss in bosses:
-                if pygame.sprite.collide_circle(plane, a_boss):
-                    plane.hp -= COLLIDE_HP_DROP
-                    plane.remove_powerup()
-
-            # Check if our plane's missile hit boss
-            for a_boss in bosses:
-                for missile in sprites.Missile.active:
-                    if pygame.sprite.collide_circle(a_boss, missile):
-                        missile.recycle()
-                        a_boss.hp -= HIT_HP_DROP
-                if a_boss.hp <= 0:
-                    score += 200
-                    a_boss.die()
-                    mark = True # player entering next level
-                    initial_boss_appear = False # launch revival method every time a new boss appears
-                    boss_number_appear += 1
-                    frame_record = frame # to record the number of frames when a boss is defeated
-
-            # End the game if the HP goes to 0
-            if plane.hp <= 0:
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    if renderer.profiler is None:
+                        profiler.reset()
+                        renderer.profiler = profiler
+                    else:
+                        renderer.profiler = None
+                        renderer.reset()  # Clear the overlay
+
+            now = time.perf_counter()
+            elapsed = now - last_time
+            last_time = now
+            frame_ms = 1000 * elapsed
+            if abs(elapsed - frame_time) < 0.002:
+                # Take a display that keeps pace with the game as exactly in
+                # step, rather than playing 0 and 2 frames by turns
+                elapsed = frame_time
+            lag = min(lag + elapsed, MAX_FRAME_LAG)
+
+            # Check if arrow key is pressed, and advance the game by the due
+            # frames. End the game if the HP goes to 0
+            frames = 0
+            alive = True
+            while alive and lag >= frame_time:
+                lag -= frame_time
+                frames += 1
+                if renderer.profiler is None:
+                    alive = state.step(provider())
+                else:
+                    alive = profiling.step(state, provider, profiler)
+            if not alive:
                 break
 
-            # Update all sprite object's positions
-            allsprites.update()
-
-            # Update the score
-            score_text = score_font.render('Score : %6d' % score, True, (225, 225, 225))
-
-            # Scroll the background
-            background1_rect.y += SCROLLING_SPEED
-            if background2_rect.y + background1_rect.y > 640:
-                background1_rect.y = 0
-            background2_rect.bottom = background1_rect.y
-
-            # Draw Everything
-            screen.blit(background, (0, background1_rect.y))
-            screen.blit(background, (0, background2_rect.y))
-            hp_bar.draw()
-            screen.blit(score_text, (10, 5))
-            allsprites.draw(screen)
-            pygame.display.flip()
-
-        # The end of game view, asking the player to choose if they want to continue
+            # Update the score, scroll the background and draw everything
+            if frames:
+                renderer.draw_frame()
+                if events is not None:
+                    events.log(telemetry.FRAME, frame=state.frame, value=frame_ms)
+
+        if record:
+            _save_recording(recording, state, record, number)
+        if profile:
+            profiler.write_csv(profile.format(game=number))
+
+        # The end of game view, asking the player to choose if they want to
+        # continue. Like the start view, it sleeps waiting for events and is
+        # drawn again only if a button changed
+        menu_meter = profiling.CpuMeter('game over menu')
+        for button in (again_button, leave_button):
+            button.over = button.isOver()
+        dirty = True
         while True:
-            clock.tick(60)  # Max FPS = 60
-            # Event handling (somehow this needs to be here to make get the mouse position work)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    return
-                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                    pygame.quit()
-                    return
-            screen.blit(background, (0, background1_rect.y))
-            screen.blit(background, (0, background2_rect.y))
-            screen.blit(gameover_image, (40, 150))
-            screen.blit(score_text, (10, 5))
-            again_button.render(screen)
-            leave_button.render(screen)
             if again_button.pressed:
                 again_button.pressed = False
                 break
@@ -348,10 +583,113 @@ def main():
                 keep_playing = False
                 leave_button.pressed = False
                 break
-            pygame.display.update()
 
+            if dirty:
+                background.draw(screen)
+                screen.blit(gameover_image, (40, 150))
+                renderer.score.draw(screen)
+                again_button.render(screen)
+                leave_button.render(screen)
+                pygame.display.update()
+                menu_meter.redraws += 1
+                dirty = False
+
+            for event in _wait_events(MENU_WAIT):
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    return
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    pygame.quit()
+                    return
+                if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    dirty = True
+                for button in (again_button, leave_button):
+                    if button.handle(event):
+                        dirty = True
+            menu_meter.wakeups += 1
+        menu_meter.stop()
+        profiler.menus.append(menu_meter)
+        if profile:
+            print(menu_meter.line())
+
+    if events is not None:
+        events.close()
+    pygame.quit()
+
+
+def replay(path: str, show: bool = False, fps: int = 60):
+    """
+    Play the game saved as an inputs.Recording at 'path' again, as fast as
+    possible, and report the speed. If 'show' is True, draw it in a window at
+    up to 'fps' frames per second (no limit if 0).
+    """
+    global MASK_MARGIN
+    recording = inputs.Recording.load(path)
+    if show:
+        pygame.init()
+        screen = pygame.display.set_mode((480, 640))
+        pygame.display.set_caption('pbc fly replay')
+        preload_images()
+        state, renderer = create_view(screen)
+        clock = pygame.time.Clock()
+    else:
+        game.setup_headless()
+        state = game.GameState()
+    state.substeps = recording.substeps
+    state.collisions = recording.collisions
+    MASK_MARGIN = recording.mask_margin
+    state.reset(recording.seed)
+    provider = inputs.ReplayInput(recording)
+
+    start_time = time.perf_counter()
+    while state.frame < len(recording) and state.step(provider()):
+        if show:
+            if pygame.event.peek(pygame.QUIT):
+                break
+            renderer.draw_frame()
+            if fps:
+                clock.tick(fps)
+    elapsed = time.perf_counter() - start_time
+    print('Replayed %d of %d frames in %.2f s, %.0f frames/s, score %d'
+          % (state.frame, len(recording), elapsed, state.frame / elapsed, state.score))
+    if state.frame != len(recording) or int(state.score) != recording.score:
+        print('Warning: the replay diverged from the recording (score %d)' % recording.score)
     pygame.quit()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='pbc fly')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without window, sound and menus, as fast as possible')
+    parser.add_argument('--games', type=int, default=1,
+                        help='number of games to play in headless mode')
+    parser.add_argument('--frames', type=int, default=None,
+                        help='end each game after this many frames')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the first game and of the random input in headless mode')
+    parser.add_argument('--record', default=None, metavar='PATH',
+                        help="save the input of each game to PATH, where '{game}' is "
+                             "replaced by the game number")
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help="time the phases of each frame and save the last frames of "
+                             "each game as CSV to PATH, where '{game}' is replaced by the "
+                             "game number")
+    parser.add_argument('--telemetry', default=None, metavar='PATH',
+                        help='log the events of the games and the frame times to PATH')
+    parser.add_argument('--replay', default=None, metavar='PATH',
+                        help='play a recorded game again as fast as possible')
+    parser.add_argument('--show', action='store_true', help='draw the replay in a window')
+    parser.add_argument('--fps', type=int, default=60,
+                        help='frame rate limit of a shown replay, 0 for none')
+    args = parser.parse_args()
+    # The other modules import this file as 'main'. Run that copy, so that
+    # they share its image cache and settings.
+    import main as main_module
+    if args.replay:
+        main_module.replay(args.replay, args.show, args.fps)
+    else:
+        main_module.main(headless=args.headless,
+                         input_provider=inputs.RandomInput(args.seed) if args.headless else None,
+                         games=args.games, max_frames=args.frames, seed=args.seed,
+                         record=args.record, profile=args.profile,
+                         telemetry_path=args.telemetry)
@@ -0,0 +1,119 @@
+"""
+This module declares the bullet patterns that enemies and bosses fire.
+
+A pattern fires a burst of 'shots' volleys, counted down from 'shots' to 1
+like the 'missile_number' attribute of the shooter. Each volley is a list of
+Shot, which are computed once when the pattern is created, for both
+directions a mirrored pattern can sweep in. Firing a volley is then a table
+lookup (see sprites.EnemyMissile.volley).
+"""
+import math
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+
+class Shot(NamedTuple):
+    """
+    'num' missiles side by side flying in 'direction'. They start at
+    'offset' times the shooter's radius from its center, or at its
+    midbottom if 'offset' is None.
+    """
+    offset: Optional[Tuple[float, float]]
+    num: int
+    direction: Tuple[float, float]
+
+
+class Pattern:
+    """
+    A burst of 'shots' volleys with 'wait' times FIRE_WAIT frames between
+    them (None leaves the shooter's count down as it is). 'volley(number,
+    mirror)' returns the shots of volley 'number', where 'mirror' is 1 or -1.
+    If 'mirrored' is True, the shooter flips the mirror before each burst.
+    """
+    def __init__(self, volley: Callable[[int, int], List[Shot]], shots: int,
+                 wait: float = None, mirrored: bool = False):
+        self.shots = shots
+        self.wait = wait
+        self.mirrored = mirrored
+        # table[mirror][number] is volley 'number', index 0 is unused
+        self.table = {mirror: [()] + [tuple(volley(number, mirror))
+                                      for number in range(1, shots + 1)]
+                      for mirror in (1, -1)}
+
+
+def single(shots: int, wait: float) -> Pattern:
+    """One missile straight down from the midbottom per volley."""
+    return Pattern(lambda number, mirror: [Shot(None, 1, (0, 1))], shots, wait)
+
+
+def ring(n: int, shots: int, wait: float) -> Pattern:
+    """'n' missiles flying out evenly around the rim of the shooter."""
+    def volley(number, mirror):
+        shots = []
+        for i in range(n):
+            vector = (math.cos(2*math.pi*i/n), math.sin(2*math.pi*i/n))
+            shots.append(Shot(vector, 1, vector))
+        return shots
+    return Pattern(volley, shots, wait)
+
+
+def twisted_ring(n: int, shots: int, wait: float) -> Pattern:
+    """
+    A ring whose missiles start rotated further around the rim at every
+    volley, while flying in the same directions.
+    """
+    def volley(number, mirror):
+        shots = []
+        for i in range(n):
+            vector = (math.cos(2*math.pi*i/n), math.sin(2*math.pi*i/n))
+            start = (math.cos(2*math.pi*(i/n) + number*2/(n+1)),
+                     math.sin(2*math.pi*(i/n) + number*2/(n+1)))
+            shots.append(Shot(start, 1, vector))
+        return shots
+    return Pattern(volley, shots, wait)
+
+
+def sweep(shots: int, wait: float, num: int = 1, x_span: float = 0.8,
+          y_span: float = 0.8, start: float = 0.1) -> Pattern:
+    """
+    'num' missiles from the midbottom per volley, turning from one side to
+    the other over the burst. The angle goes from 'start' to 'start' +
+    'x_span' half turns for the horizontal part of the direction and to
+    'start' + 'y_span' for the vertical part.
+    """
+    def volley(number, mirror):
+        vector = (mirror*math.cos(math.pi*(x_span*number/shots + start)),
+                  math.sin(math.pi*(y_span*number/shots + start)))
+        return [Shot(None, num, vector)]
+    return Pattern(volley, shots, wait, mirrored=True)
+
+
+def spread(sixths: Tuple[int, ...], num: int) -> Pattern:
+    """
+    One volley of rows of 'num' missiles from the midbottom: one row flying
+    straight down and one at each angle of 'sixths', in sixths of a full
+    turn clockwise from the right.
+    """
+    def volley(number, mirror):
+        shots = [Shot(None, num, (0, 1))]
+        for sixth in sixths:
+            shots.append(Shot(None, num, (math.cos(2*math.pi*sixth/6),
+                                          math.sin(2*math.pi*sixth/6))))
+        return shots
+    return Pattern(volley, 1)
+
+
+# The pattern of each kind of enemy and boss, indexed by 'number_appear'
+ENEMY_PATTERNS = (
+    ring(6, 5, 0.5),
+    single(3, 1),
+    single(3, 1),
+    single(3, 1),
+    twisted_ring(6, 5, 0.5),
+)
+BOSS_PATTERNS = (
+    sweep(10, 0.8, num=2, y_span=0.4),
+    sweep(20, 0.3),
+    sweep(10, 0.8, num=2, y_span=0.4),
+    spread((1, 2), 3),
+    sweep(20, 0.3),
+)
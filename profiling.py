@@ -0,0 +1,193 @@
+"""
+This module times the phases of each frame of the game loop and shows the
+timings in an overlay. Nothing is timed while profiling is off: the game
+loop then takes its usual path and the renderers skip every mark. The
+menus, which wait for events instead of running frames, are measured by
+the CPU time they use (see CpuMeter).
+"""
+import collections
+import csv
+import time
+from typing import List
+import pygame
+import sprites
+
+
+class FrameProfiler:
+    """
+    Per-phase timings of the last 'size' frames of a game.GameState, kept in
+    a ring buffer. A frame is timed by calling start(), then mark(phase) at
+    the end of each phase, then end(). Each mark adds the time since the
+    previous one to 'phase'. The 'wait' phase is the time between frames,
+    spent in the clock and the event handling. A drawn frame that plays
+    several game frames to catch up counts them all.
+
+    The overlay drawn by draw() shows the mean time of each phase and the
+    frame time percentiles over the buffer, the live sprite counts and the
+    sizes of the pools. It is rendered again every 'refresh' frames.
+    """
+    PHASES = ('wait', 'input', 'spawn', 'collision', 'update',
+              'hud', 'background', 'sprites', 'overlay', 'flip')
+
+    def __init__(self, state, size: int = 600, refresh: int = 30,
+                 font: pygame.font.Font = None):
+        self.state = state
+        self.samples = collections.deque(maxlen=size)  # (frame, phase times..., frame time)
+        self.refresh = refresh
+        self.font = font or pygame.font.Font(None, 18)
+        self.times = dict.fromkeys(self.PHASES, 0.0)  # Phase times of the current frame
+        self.last = None  # Time of the previous mark
+        self.last_end = None  # Time the previous frame ended
+        self.open = False  # Whether start() was called without end()
+        self.overlay = None
+        self.overlay_age = 0
+        self.position = (470, 30)  # Top right corner of the overlay
+        self.menus = collections.deque(maxlen=2)  # CpuMeter of the last menus
+
+    def start(self):
+        """Start timing a frame, unless one was started already."""
+        if self.open:
+            return
+        self.open = True
+        now = time.perf_counter()
+        times = self.times
+        for phase in times:
+            times[phase] = 0.0
+        if self.last_end is not None:
+            times['wait'] = now - self.last_end
+        self.last = now
+
+    def mark(self, phase: str):
+        """Add the time since the previous mark to 'phase'."""
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+
+    def end(self):
+        """Finish the frame and store its timings."""
+        self.open = False
+        self.last_end = self.last
+        times = self.times
+        self.samples.append((self.state.frame,) + tuple(times.values())
+                            + (sum(times.values()) - times['wait'],))
+
+    def reset(self):
+        """Forget the stored frames, e.g. when profiling is switched back on."""
+        self.samples.clear()
+        self.open = False
+        self.last_end = None
+        self.overlay = None
+
+    def percentiles(self, fractions=(0.5, 0.95, 0.99)) -> List[float]:
+        """Return the frame times of the buffer at 'fractions', in seconds."""
+        frame_times = sorted(sample[-1] for sample in self.samples)
+        if not frame_times:
+            return [0.0] * len(fractions)
+        return [frame_times[min(len(frame_times) - 1, int(fraction * len(frame_times)))]
+                for fraction in fractions]
+
+    def lines(self) -> List[str]:
+        """Return the text of the overlay."""
+        state = self.state
+        count = len(self.samples) or 1
+        lines = ['%-10s %6.2f ms' % (phase, 1000 * sum(sample[i + 1] for sample in self.samples)
+                                     / count)
+                 for i, phase in enumerate(self.PHASES)]
+        lines.append('p50/95/99 %s ms' % '/'.join('%.1f' % (1000 * value)
+                                                  for value in self.percentiles()))
+        field = state.bullet_field
+        lines.append('missiles %d  enemy missiles %d'
+                     % (len(sprites.Missile.active), len(sprites.EnemyMissile.active)
+                        + (len(field) if field is not None else 0)))
+        lines.append('enemies %d  bosses %d' % (len(state.enemies), len(state.bosses)))
+        for pooled_class, pool in state.pools.items():
+            lines.append('%s %d/%d' % (pooled_class.__name__, len(pool.active), pool.created))
+        for meter in self.menus:
+            lines.append('%s cpu %.1f%%' % (meter.name, 100 * meter.usage()))
+        return lines
+
+    def draw(self, surface: pygame.Surface) -> pygame.Rect:
+        """Draw the overlay on 'surface' and return the area it covers."""
+        if self.overlay is None or self.overlay_age >= self.refresh:
+            rendered = [self.font.render(line, True, (255, 255, 0)) for line in self.lines()]
+            height = self.font.get_linesize()
+            self.overlay = pygame.Surface((max(text.get_width() for text in rendered) + 8,
+                                           height * len(rendered) + 8))
+            self.overlay.set_alpha(200)
+            for i, text in enumerate(rendered):
+                self.overlay.blit(text, (4, 4 + i * height))
+            self.overlay_age = 0
+        self.overlay_age += 1
+        return surface.blit(self.overlay, self.overlay.get_rect(topright=self.position))
+
+    def write_csv(self, path):
+        """Save the frames of the buffer to the CSV file 'path', times in milliseconds."""
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('frame',) + self.PHASES + ('frame_ms',))
+            for sample in self.samples:
+                writer.writerow((sample[0],) + tuple(round(1000 * value, 4)
+                                                     for value in sample[1:]))
+
+
+class CpuMeter:
+    """
+    The CPU time used by the process, in all its threads, against the
+    wall-clock time from creation to stop(), such as while the menu 'name'
+    is shown. The menu counts how often it woke up and redrew meanwhile.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.wakeups = 0
+        self.redraws = 0
+        self.cpu = self.wall = 0.0
+        self.start_cpu = time.process_time()
+        self.start_wall = time.perf_counter()
+
+    def stop(self):
+        """Stop measuring."""
+        self.cpu = time.process_time() - self.start_cpu
+        self.wall = time.perf_counter() - self.start_wall
+
+    def usage(self) -> float:
+        """Return the CPU time used per second of wall-clock time."""
+        return self.cpu / self.wall if self.wall else 0.0
+
+    def line(self) -> str:
+        """Return the measurements as a line of text."""
+        return ('%s: %.1f s, cpu %.2f s (%.1f%%), %d wakeups, %d redraws'
+                % (self.name, self.wall, self.cpu, 100 * self.usage(),
+                   self.wakeups, self.redraws))
+
+
+def step(state, input_provider, profiler: FrameProfiler) -> bool:
+    """
+    Do what state.step(input_provider()) does, marking each phase in
+    'profiler'. The frame is left open for the renderer to mark its phases
+    and end it, unless the game is over.
+    """
+    profiler.start()
+    buttons = input_provider()
+    state.begin_frame(buttons)
+    profiler.mark('input')
+    state.spawn()
+    profiler.mark('spawn')
+    for _ in range(state.substeps):
+        state.collide()
+        profiler.mark('collision')
+        if state.plane.hp <= 0:
+            state.end()
+            profiler.end()
+            return False
+        state.move()
+        profiler.mark('update')
+    state.update()
+    profiler.mark('update')
+    return True
+
+
+def play(state, input_provider, max_frames: int, profiler: FrameProfiler) -> int:
+    """Do what game.play() does without drawing, timing every frame in 'profiler'."""
+    while state.frame != max_frames and step(state, input_provider, profiler):
+        profiler.end()
+    return state.frame
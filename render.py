@@ -0,0 +1,258 @@
+"""
+This module draws the game view onto the display.
+"""
+from typing import List, Tuple
+import pygame
+import sprites
+
+
+class ScrollingBackground:
+    """
+    A background image that scrolls down and wraps around. Two copies are
+    drawn, one right above the other.
+    """
+    def __init__(self, image: pygame.Surface, speed: int):
+        self.image = image
+        self.speed = speed
+        self.height = image.get_height()
+        self.rect1 = pygame.Rect(0, 0, image.get_width(), self.height)
+        self.rect2 = pygame.Rect(0, 0, image.get_width(), self.height)
+
+    def scroll(self, frames: int = 1):
+        """Move the background by the distance of 'frames' frames."""
+        self.rect1.y += self.speed * frames
+        if self.rect2.y + self.rect1.y > self.height:
+            self.rect1.y = 0
+        self.rect2.bottom = self.rect1.y
+
+    def draw(self, surface: pygame.Surface):
+        """Draw both copies of the background."""
+        surface.blit(self.image, (0, self.rect1.y))
+        surface.blit(self.image, (0, self.rect2.y))
+
+
+class ScoreText:
+    """
+    The score of a game.GameState as text, drawn on its own 'image' at
+    'position', again only when the whole score changed. The label and each
+    digit are rendered once and kept, and the text is put together from them.
+    """
+    label = 'Score : '
+    color = (225, 225, 225)
+
+    def __init__(self, font: pygame.font.Font, state, position: Tuple[int, int]):
+        self.font = font
+        self.state = state
+        self.glyphs = {}  # Rendered text of the label and each character
+        self.image = None
+        self.rect = pygame.Rect(position, (0, 0))
+        self.shown_score = None  # The score drawn on 'image'
+
+    def glyph(self, text: str) -> pygame.Surface:
+        """Return 'text' rendered, rendering it only the first time."""
+        glyph = self.glyphs.get(text)
+        if glyph is None:
+            glyph = self.glyphs[text] = self.font.render(text, True, self.color)
+        return glyph
+
+    def update(self) -> bool:
+        """Draw the text on 'image' if the score changed. Return whether it did."""
+        score = int(self.state.score)
+        if score == self.shown_score:
+            return False
+        self.shown_score = score
+        text = self.label + '%6d' % score
+        # Each glyph goes where it would be in the whole text, which the
+        # font measures without rendering
+        pieces = [(self.glyph(self.label), 0)]
+        pieces.extend((self.glyph(text[i]), self.font.size(text[:i])[0])
+                      for i in range(len(self.label), len(text)))
+        self.image = pygame.Surface(self.font.size(text), pygame.SRCALPHA)
+        for glyph, x in pieces:
+            # The glyphs do not overlap, so taking the maximum copies them
+            # with their alpha onto the transparent image
+            self.image.blit(glyph, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        self.rect.size = self.image.get_size()
+        return True
+
+    def draw(self, surface: pygame.Surface):
+        """Draw the text on 'surface'."""
+        self.update()
+        surface.blit(self.image, self.rect)
+
+
+class Hud:
+    """
+    The indicators drawn over the game view, such as the ScoreText and the
+    sprites.HpBar. Each one has an 'image' and a 'rect', and an update()
+    method that draws its image again if the value it shows changed.
+    """
+    def __init__(self, elements: List):
+        self.elements = elements
+
+    def update(self) -> List[pygame.Rect]:
+        """Update every element and return the areas that changed."""
+        changed = []
+        for element in self.elements:
+            old_rect = pygame.Rect(element.rect)
+            if element.update():
+                changed.append(old_rect.union(element.rect))
+        return changed
+
+    def draw(self, surface: pygame.Surface):
+        """Draw every element on 'surface'."""
+        surface.blits([(element.image, element.rect) for element in self.elements],
+                      doreturn=False)
+
+
+class FullRenderer:
+    """
+    Draw the whole view of a game.GameState every frame and flip the display.
+    The 'allsprites' group of the state must be of type 'group_class'. The
+    background scrolls with the game frames played since the last drawing,
+    however many there were.
+    """
+    group_class = pygame.sprite.RenderPlain
+    score_position = (10, 5)
+    profiler = None  # A profiling.FrameProfiler to mark the drawing phases in, if profiling
+
+    def __init__(self, screen: pygame.Surface, state, background: ScrollingBackground,
+                 font: pygame.font.Font):
+        self.screen = screen
+        self.state = state
+        self.background = background
+        self.font = font
+        self.hp_bar = sprites.HpBar(state.plane)  # Track the plane's hp attr
+        self.score = ScoreText(font, state, self.score_position)
+        self.hud = Hud([self.score, self.hp_bar])
+        self.shown_frame = 0  # The game frame drawn last
+
+    def reset(self):
+        """Forget what is on the display, e.g. after a menu was drawn over it."""
+
+    def frames_played(self) -> int:
+        """Return the number of game frames since the last drawing, and reset it."""
+        frame = self.state.frame
+        if frame < self.shown_frame:  # A new game
+            self.shown_frame = 0
+        frames = frame - self.shown_frame
+        self.shown_frame = frame
+        return frames
+
+    def draw_frame(self):
+        """Scroll the background and draw one frame of the game."""
+        profiler = self.profiler
+        self.hud.update()
+        if profiler:
+            profiler.mark('hud')
+        self.background.scroll(self.frames_played())
+        self.background.draw(self.screen)
+        self.hud.draw(self.screen)
+        if profiler:
+            profiler.mark('background')
+        self.state.allsprites.draw(self.screen)
+        if self.state.bullet_field is not None:
+            self.state.bullet_field.draw(self.screen)
+        if profiler:
+            profiler.mark('sprites')
+            profiler.draw(self.screen)
+            profiler.mark('overlay')
+        pygame.display.flip()
+        if profiler:
+            profiler.mark('flip')
+            profiler.end()
+
+
+class DirtyRenderer(FullRenderer):
+    """
+    Only update the parts of the display that changed since the last frame.
+
+    The background and the HUD (HP bar and score) are composed on a canvas,
+    which is redrawn only where the HUD changed. A LayeredDirty group draws
+    the sprites over the canvas and returns the rects they touched. The
+    background scrolls once every 'scroll_interval' game frames (never if 0), and
+    those frames repaint the whole screen, so the longer the interval, the
+    more frames update only the changed rects and the coarser the steps the
+    background moves in. Whenever the changed area is more than 'threshold'
+    of the screen, the display is flipped instead.
+    """
+    group_class = pygame.sprite.LayeredDirty
+
+    def __init__(self, screen: pygame.Surface, state, background: ScrollingBackground,
+                 font: pygame.font.Font, threshold: float = 0.5, scroll_interval: int = 4):
+        super().__init__(screen, state, background, font)
+        self.threshold = threshold
+        self.scroll_interval = scroll_interval
+        self.screen_rect = screen.get_rect()
+        self.canvas = pygame.Surface(self.screen_rect.size).convert()
+        state.allsprites.clear(screen, self.canvas)
+        self.field_rects = []  # Where the bullet field was drawn last frame
+        self.overlay_rect = None  # Where the profiler overlay was drawn last frame
+        self.repaint_all = True
+
+    def reset(self):
+        self.repaint_all = True
+
+    def _draw_canvas(self, area: pygame.Rect = None):
+        """Draw the background and the HUD on the canvas, only inside 'area' if given."""
+        self.canvas.set_clip(area)
+        self.background.draw(self.canvas)
+        self.hud.draw(self.canvas)
+        self.canvas.set_clip(None)
+
+    def draw_frame(self):
+        profiler = self.profiler
+        allsprites = self.state.allsprites
+        bullet_field = self.state.bullet_field
+        repaint_all = self.repaint_all
+        if self.scroll_interval:
+            frames = self.frames_played()
+            frame = self.shown_frame
+            scrolls = frame // self.scroll_interval - (frame - frames) // self.scroll_interval
+            if scrolls:
+                self.background.scroll(scrolls * self.scroll_interval)
+                repaint_all = True
+
+        changed = self.hud.update()
+        if profiler:
+            profiler.mark('hud')
+
+        if repaint_all:
+            self._draw_canvas()
+            allsprites.repaint_rect(self.screen_rect)
+            self.repaint_all = False
+        else:
+            for rect in changed:
+                self._draw_canvas(rect)
+                allsprites.repaint_rect(rect)
+            # Missiles of the field are not in the group, so their old spots
+            # are cleared by repainting them
+            for rect in self.field_rects:
+                allsprites.repaint_rect(rect)
+            if self.overlay_rect is not None:
+                allsprites.repaint_rect(self.overlay_rect)
+        if profiler:
+            profiler.mark('background')
+
+        dirty_rects = allsprites.draw(self.screen)
+        self.field_rects = []
+        if bullet_field is not None:
+            self.field_rects = bullet_field.draw(self.screen, dirty=True)
+            dirty_rects.extend(self.field_rects)
+        if self.overlay_rect is not None:
+            dirty_rects.append(self.overlay_rect)  # Show the spot cleared after the overlay
+            self.overlay_rect = None
+        if profiler:
+            profiler.mark('sprites')
+            self.overlay_rect = profiler.draw(self.screen)
+            dirty_rects.append(self.overlay_rect)
+            profiler.mark('overlay')
+
+        dirty_area = sum(rect.width * rect.height for rect in dirty_rects)
+        if dirty_area > self.threshold * self.screen_rect.width * self.screen_rect.height:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty_rects)
+        if profiler:
+            profiler.mark('flip')
+            profiler.end()
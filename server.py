@@ -0,0 +1,427 @@
+"""
+Run games on a server for thin clients, many sessions in one asyncio event
+loop. Each connection is a session: a game ticked at a fixed rate with the
+buttons the client sends, whose sprites are streamed back as delta updates
+holding only what changed since the last update sent.
+
+    python server.py --port 5555            # Serve on TCP
+    python server.py --unix /tmp/pbc.sock   # Serve on a Unix socket
+    python server.py --load-test 32         # Serve 32 stand-in clients for 10 s
+
+The protocol is little endian. The client starts with HELLO, then sends one
+byte per frame: the button mask (see the inputs module) of the next frame
+not played yet. The server queues them and holds the last buttons while the
+queue is empty. Every server message is its length as a uint32 followed by
+its body, whose first byte is the type:
+
+- UPDATE: the frame, score and HP, then the sprites shown (id, image, x,
+  y), moved (id, dx, dy) and hidden (id). The image is the index of the
+  image in main.IMAGE_MANIFEST and x, y the top left corner of the sprite.
+  A sprite is shown when it is new, has another image or moved by 128
+  pixels or more, and moved when only its position changed, by dx and dy.
+  The first update of a game shows every sprite.
+- GAME_OVER: the frame and score of the game that ended. The client forgets
+  its sprites, and the next game starts right away with the next seed.
+
+A session whose client does not read fast enough skips updates. Since each
+update is relative to the last one sent, the next one catches up.
+"""
+import argparse
+import asyncio
+from collections import deque
+import struct
+import time
+from typing import Dict, List
+import pygame
+import game
+import inputs
+import main
+import telemetry
+
+
+PORT = 5555
+MAGIC = b'PBCS'
+VERSION = 1
+HELLO = struct.Struct('<4sBq')  # Magic, version, seed (-1 for a random one)
+LENGTH = struct.Struct('<I')  # Length of the body of a server message
+UPDATE, GAME_OVER = 1, 2
+UPDATE_HEADER = struct.Struct('<BIiiHHH')  # Type, frame, score, HP, shown, moved, hidden
+SHOWN = struct.Struct('<HBhh')  # Id, image, x, y
+MOVED = struct.Struct('<Hbb')  # Id, dx, dy
+HIDDEN = struct.Struct('<H')  # Id
+GAME_OVER_MESSAGE = struct.Struct('<BIi')  # Type, frame, score
+UNKNOWN_IMAGE = 255  # Image index of a sprite whose image is not in main.IMAGE_MANIFEST
+MAX_INPUT_QUEUE = 8  # Frames of buttons queued per session, older ones are dropped
+MAX_WRITE_BUFFER = 64 * 1024  # Bytes waiting to be sent above which updates are skipped
+
+
+def image_indices() -> Dict[pygame.Surface, int]:
+    """Return the index in main.IMAGE_MANIFEST of every image of the image cache."""
+    indices = {}
+    for i, entry in enumerate(main.IMAGE_MANIFEST):
+        indices.setdefault(main.load_image(*entry)[0], i)
+    return indices
+
+
+class Session:
+    """
+    The game of one client. tick() plays a frame with the next buttons the
+    client sent and writes the update to 'writer'. The game is seeded with
+    'seed' and the games after it with the seeds that follow, or randomly
+    if 'seed' is None.
+
+    Enemy missiles are always sprites (see main.ENEMY_MISSILE_BACKEND), so
+    that each one has an id the updates can refer to. The events of the
+    game are logged to 'events', if given, as session 'number'.
+    """
+    def __init__(self, number: int, writer: asyncio.StreamWriter, seed: int,
+                 images: Dict[pygame.Surface, int], events: telemetry.Telemetry = None):
+        self.number = number
+        self.writer = writer
+        self.images = images
+        self.seeded = seed is not None
+        self.state = game.GameState(bullet_backend='sprite')
+        self.state.telemetry = events
+        self.state.session = number
+        self.state.reset(seed)
+        self.buttons = deque(maxlen=MAX_INPUT_QUEUE)  # Buttons of the frames to come
+        self.held = 0  # Buttons of the last frame
+        self.ids = {}  # Id of every sprite the client has
+        self.free_ids = []  # Ids of hidden sprites, given again first
+        self.next_id = 0
+        self.sent = {}  # (image, x, y) of every sprite the client has
+        self.start_time = time.perf_counter()
+        self.stats = {'ticks': 0, 'bytes': 0, 'skipped': 0, 'games': 1}
+
+    def tick(self):
+        """Play a frame and send what changed to the client."""
+        if self.writer.is_closing():
+            return
+        if self.buttons:
+            self.held = self.buttons.popleft()
+        state = self.state
+        stats = self.stats
+        stats['ticks'] += 1
+        if not state.step(self.held):
+            self._send(GAME_OVER_MESSAGE.pack(GAME_OVER, state.frame, int(state.score)))
+            state.reset(state.seed + 1 if self.seeded else None)
+            stats['games'] += 1
+            self.ids.clear()
+            self.free_ids.clear()
+            self.next_id = 0
+            self.sent.clear()
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            stats['skipped'] += 1
+            return
+        self._send(self.update())
+
+    def _send(self, body: bytes):
+        self.writer.write(LENGTH.pack(len(body)) + body)
+        self.stats['bytes'] += LENGTH.size + len(body)
+
+    def _new_id(self) -> int:
+        if self.free_ids:
+            return self.free_ids.pop()
+        self.next_id += 1
+        return self.next_id - 1
+
+    def update(self) -> bytes:
+        """
+        Return the body of the UPDATE from the last update sent to the
+        current state, and take it as sent.
+        """
+        images = self.images
+        ids = self.ids
+        sent = self.sent
+        current = {}
+        shown = []
+        moved = []
+        for sprite in self.state.allsprites:
+            rect = sprite.rect
+            value = (images.get(sprite.image, UNKNOWN_IMAGE), rect.x, rect.y)
+            current[sprite] = value
+            old = sent.get(sprite)
+            if old == value:
+                continue
+            if old is None:
+                ids[sprite] = self._new_id()
+                shown.append(SHOWN.pack(ids[sprite], *value))
+                continue
+            dx = rect.x - old[1]
+            dy = rect.y - old[2]
+            if old[0] != value[0] or not -128 <= dx < 128 or not -128 <= dy < 128:
+                shown.append(SHOWN.pack(ids[sprite], *value))
+            else:
+                moved.append(MOVED.pack(ids[sprite], dx, dy))
+        # Ids are freed after the new sprites got theirs, so that an update
+        # never gives an id that it also hides
+        hidden = []
+        for sprite in sent.keys() - current.keys():
+            sprite_id = ids.pop(sprite)
+            self.free_ids.append(sprite_id)
+            hidden.append(HIDDEN.pack(sprite_id))
+        self.sent = current
+        state = self.state
+        return b''.join([UPDATE_HEADER.pack(UPDATE, state.frame, int(state.score),
+                                            int(state.plane.hp), len(shown), len(moved),
+                                            len(hidden))]
+                        + shown + moved + hidden)
+
+    def report(self) -> str:
+        """Return a line of the ticks per second and bytes per frame of the session."""
+        stats = self.stats
+        ticks = stats['ticks']
+        elapsed = time.perf_counter() - self.start_time
+        return ('session %d: %.1f ticks/s, %.1f bytes/frame, %d games, %d updates skipped'
+                % (self.number, ticks / elapsed if elapsed else 0.0,
+                   stats['bytes'] / ticks if ticks else 0.0, stats['games'], stats['skipped']))
+
+
+class GameServer:
+    """
+    Accept clients on TCP or a Unix socket and tick all their sessions
+    'rate' times per second (main.FRAME_RATE if not given) in turns. If
+    'events' is given, the events of every session and the time of every
+    tick, as session 0, are logged to it.
+    """
+    def __init__(self, rate: int = None, events: telemetry.Telemetry = None):
+        if pygame.display.get_surface() is None:
+            game.setup_headless()
+        self.rate = rate or main.FRAME_RATE
+        self.events = events
+        self.images = image_indices()
+        self.sessions: List[Session] = []
+        self.sessions_started = 0
+        self.handlers = set()  # Task serving each connection
+        self.server = None
+        self.ticker = None
+        self.ticks = 0
+        self.late_ticks = 0  # Ticks that ended after the next one was due
+        self.tick_time = 0.0  # Seconds spent ticking the sessions
+        self.start_time = time.perf_counter()
+
+    async def start(self, host: str = '127.0.0.1', port: int = PORT, unix: str = None):
+        """Listen on 'host' and 'port', or on the Unix socket 'unix', and start ticking."""
+        if unix:
+            self.server = await asyncio.start_unix_server(self._serve, unix)
+        else:
+            self.server = await asyncio.start_server(self._serve, host, port)
+        self.start_time = time.perf_counter()
+        self.ticker = asyncio.ensure_future(self._tick_loop())
+
+    async def stop(self):
+        """Stop ticking and close the connections."""
+        self.ticker.cancel()
+        self.server.close()
+        for session in self.sessions:
+            session.writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            await self._play(reader, writer)
+        finally:
+            self.handlers.discard(handler)
+
+    async def _play(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            magic, version, seed = HELLO.unpack(await reader.readexactly(HELLO.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if magic != MAGIC or version != VERSION:
+            writer.close()
+            return
+        self.sessions_started += 1
+        session = Session(self.sessions_started, writer, None if seed < 0 else seed,
+                          self.images, self.events)
+        self.sessions.append(session)
+        try:
+            while True:
+                data = await reader.read(MAX_INPUT_QUEUE)
+                if not data:
+                    break
+                session.buttons.extend(byte & 15 for byte in data)
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions.remove(session)
+            writer.close()
+
+    async def _tick_loop(self):
+        loop = asyncio.get_running_loop()
+        period = 1 / self.rate
+        next_time = loop.time()
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            for session in list(self.sessions):
+                session.tick()
+            tick_time = clock() - start
+            self.tick_time += tick_time
+            self.ticks += 1
+            if self.events is not None:
+                self.events.log(telemetry.FRAME, frame=self.ticks, value=1000 * tick_time)
+            next_time += period
+            delay = next_time - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                if delay < -main.MAX_FRAME_LAG:
+                    next_time = loop.time()  # Too far behind to catch up
+            await asyncio.sleep(max(delay, 0))
+
+    def report(self) -> List[str]:
+        """Return a line about the server, then a line per session (see Session.report())."""
+        elapsed = time.perf_counter() - self.start_time
+        ticks = self.ticks
+        lines = ['%d sessions: %.1f ticks/s of %d, %d late, %.2f ms per tick'
+                 % (len(self.sessions), ticks / elapsed if elapsed else 0.0, self.rate,
+                    self.late_ticks, 1000 * self.tick_time / ticks if ticks else 0.0)]
+        lines.extend(session.report() for session in self.sessions)
+        return lines
+
+
+class LoadClient:
+    """
+    A stand-in for a thin client, for load tests. It sends random buttons,
+    the next frame's for every update it receives, and applies the updates
+    to its own copy of the sprites, which checks that they add up.
+    """
+    def __init__(self, seed: int = None):
+        self.input = inputs.RandomInput(seed)
+        self.sprites = {}  # (image, x, y) of every sprite id
+        self.frame = 0
+        self.score = 0
+        self.hp = 0
+        self.stats = {'bytes': 0, 'updates': 0, 'games': 0}
+
+    async def run(self, host: str = '127.0.0.1', port: int = PORT, unix: str = None,
+                  seed: int = None):
+        """Play on the server until cancelled, with the games seeded from 'seed'."""
+        if unix:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        writer.write(HELLO.pack(MAGIC, VERSION, -1 if seed is None else seed))
+        writer.write(bytes((self.input(),)))
+        try:
+            while True:
+                length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                body = await reader.readexactly(length)
+                self.stats['bytes'] += LENGTH.size + length
+                if body[0] == GAME_OVER:
+                    self.sprites.clear()
+                    self.stats['games'] += 1
+                    continue
+                self.apply(body)
+                writer.write(bytes((self.input(),)))
+        finally:
+            writer.close()
+
+    def apply(self, body: bytes):
+        """Apply the UPDATE 'body' to the sprites."""
+        _, self.frame, self.score, self.hp, shown, moved, hidden = \
+            UPDATE_HEADER.unpack_from(body)
+        sprites = self.sprites
+        start = UPDATE_HEADER.size
+        end = start + shown * SHOWN.size
+        for sprite_id, image, x, y in SHOWN.iter_unpack(body[start:end]):
+            sprites[sprite_id] = (image, x, y)
+        start, end = end, end + moved * MOVED.size
+        for sprite_id, dx, dy in MOVED.iter_unpack(body[start:end]):
+            if sprite_id not in sprites:
+                raise ValueError('Update moves the unknown sprite %d' % sprite_id)
+            image, x, y = sprites[sprite_id]
+            sprites[sprite_id] = (image, x + dx, y + dy)
+        start, end = end, end + hidden * HIDDEN.size
+        for sprite_id, in HIDDEN.iter_unpack(body[start:end]):
+            del sprites[sprite_id]
+        if end != len(body):
+            raise ValueError('Update of %d bytes, %d expected' % (len(body), end))
+        self.stats['updates'] += 1
+
+
+async def load_test(clients: int, seconds: float, host: str = '127.0.0.1', port: int = PORT,
+                    unix: str = None, serve: bool = True, rate: int = None,
+                    events: telemetry.Telemetry = None) -> List[str]:
+    """
+    Play 'clients' LoadClients, seeded 0, 1, ..., for 'seconds' seconds, on
+    a server started here if 'serve', else on one already running. Return
+    the report of the server, if any, and of the clients.
+    """
+    server = None
+    if serve:
+        server = GameServer(rate, events)
+        await server.start(host, port, unix)
+    load_clients = [LoadClient(seed) for seed in range(clients)]
+    tasks = [asyncio.ensure_future(client.run(host, port, unix, seed))
+             for seed, client in enumerate(load_clients)]
+    await asyncio.sleep(seconds)
+    lines = server.report() if server is not None else []
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        # Before Python 3.8, the CancelledError of the tasks just cancelled
+        # is an Exception too
+        if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+            raise result
+    if server is not None:
+        await server.stop()
+    updates = sum(client.stats['updates'] for client in load_clients)
+    received = sum(client.stats['bytes'] for client in load_clients)
+    lines.append('%d clients: %.1f updates/s each, %.1f bytes/update, %d games ended'
+                 % (clients, updates / clients / seconds, received / updates if updates else 0.0,
+                    sum(client.stats['games'] for client in load_clients)))
+    return lines
+
+
+async def serve(host: str, port: int, unix: str = None, rate: int = None,
+                interval: float = 10, events: telemetry.Telemetry = None):
+    """Run a GameServer until interrupted, printing its report every 'interval' seconds."""
+    server = GameServer(rate, events)
+    await server.start(host, port, unix)
+    print('Serving on %s' % (unix or '%s:%d' % (host, port)), flush=True)
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            print('\n'.join(server.report()), flush=True)
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve pbc fly games to thin clients')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='TCP port to listen on')
+    parser.add_argument('--unix', default=None, metavar='PATH',
+                        help='listen on the Unix socket PATH instead of TCP')
+    parser.add_argument('--rate', type=int, default=None,
+                        help='ticks per second (default: main.FRAME_RATE)')
+    parser.add_argument('--report', type=float, default=10, metavar='SECONDS',
+                        help='time between the reports of the server')
+    parser.add_argument('--load-test', type=int, default=0, metavar='CLIENTS',
+                        help='play this many stand-in clients and report, instead of serving')
+    parser.add_argument('--seconds', type=float, default=10, help='length of the load test')
+    parser.add_argument('--external', action='store_true',
+                        help='run the load test against a server already running')
+    parser.add_argument('--telemetry', default=None, metavar='PATH',
+                        help='log the events of the sessions and the tick times to PATH')
+    args = parser.parse_args()
+
+    server_events = telemetry.Telemetry(args.telemetry) if args.telemetry else None
+    try:
+        if args.load_test:
+            print('\n'.join(asyncio.run(load_test(args.load_test, args.seconds, args.host,
+                                                  args.port, args.unix, not args.external,
+                                                  args.rate, server_events))))
+        else:
+            asyncio.run(serve(args.host, args.port, args.unix, args.rate, args.report,
+                              server_events))
+    except KeyboardInterrupt:
+        pass
+    if server_events is not None:
+        server_events.close()
+        print(server_events.line())
@@ -2,11 +2,12 @@
 """
 This module handles all battle mechanisms.
 """
-import math
 import random
-from typing import Tuple
+from typing import Sequence, Tuple
 import pygame
+import inputs
 import main
+import patterns
 
 
 # Constants to control gameplay and hardness
@@ -22,9 +23,165 @@ HP_BOSS = 200
 HP_ENEMY = 30
 FIRE_WAIT = 25
 ENEMY_FIRE_PERIOD = 120
+OFFSCREEN_MARGIN = 0  # Enemy missiles are recycled this many pixels beyond the screen
 
+# Random numbers of the game being played, replaced by game.GameState.bind()
+rng = random.Random()
 
-class Plane(pygame.sprite.Sprite):
+
+class Pool:
+    """
+    Free list of reusable sprites with constant time acquire() and release().
+
+    'size' sprites are created up front by calling 'factory'. Further ones are
+    created on demand until 'max_size' sprites exist (None means no cap). At
+    the cap, acquire() follows the 'overflow' policy: Pool.DROP returns None,
+    Pool.REUSE takes back the sprite that has been active the longest.
+    Acquired sprites are kept in the 'active' group until released.
+    """
+    DROP = 'drop'
+    REUSE = 'reuse'
+
+    def __init__(self, factory, size: int = 0, max_size: int = None, overflow: str = DROP):
+        self.factory = factory
+        self.max_size = max_size
+        self.overflow = overflow
+        self.free = [factory() for _ in range(size)]
+        self.active = pygame.sprite.Group()
+        self.created = size  # Number of sprites ever made by this pool
+        self.high_water = 0  # Most sprites active at the same time
+        self.overflows = 0  # Number of acquire() calls made at the cap
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self, force: bool = False):
+        """
+        Return a free sprite and mark it active, or None if dropped. With
+        'force', a new sprite is created at the cap instead of following the
+        overflow policy, and the pool keeps it.
+        """
+        if self.free:
+            sprite = self.free.pop()
+        elif force or self.max_size is None or self.created < self.max_size:
+            sprite = self.factory()
+            self.created += 1
+        else:
+            self.overflows += 1
+            if self.overflow != Pool.REUSE or not self.active:
+                return None
+            # Groups keep insertion order, so the first one is the oldest
+            sprite = next(iter(self.active.spritedict))
+            self.active.remove(sprite)
+        self.active.add(sprite)
+        if len(self.active) > self.high_water:
+            self.high_water = len(self.active)
+        return sprite
+
+    def release(self, sprite):
+        """Put an active sprite back to the free list. Releasing twice is harmless."""
+        if sprite in self.active:
+            self.active.remove(sprite)
+            self.free.append(sprite)
+
+    def release_all(self):
+        """Put every active sprite back to the free list."""
+        self.free.extend(self.active.sprites())
+        self.active.empty()
+
+    def stats(self) -> dict:
+        """Return the counters of the pool."""
+        return {'free': len(self.free),
+                'active': len(self.active),
+                'created': self.created,
+                'high_water': self.high_water,
+                'overflows': self.overflows}
+
+
+class MovingSprite(pygame.sprite.DirtySprite):
+    """
+    Base class for sprites that move. The position is kept in floats in
+    'pos', the top left corner of the rect, and 'velocity' is the motion in
+    pixels per frame, so slow and fractional speeds add up instead of being
+    truncated by the integer rect.
+
+    move() advances the position by a part of a frame and puts the rect at
+    the rounded position. update() does the rest of the frame's work, like
+    turning, firing or leaving the screen. Code that sets the rect directly
+    calls place() afterwards.
+    """
+    def __init__(self):
+        super().__init__()
+        self.dirty = 2  # Moves every frame, so a LayeredDirty group always redraws it
+        self.pos = pygame.Vector2()
+        self.velocity = pygame.Vector2()
+
+    def place(self):
+        """Take the position of the rect as the float position."""
+        self.pos.update(self.rect.topleft)
+
+    def move(self, dt: float = 1):
+        """Move by the velocity of 'dt' frames."""
+        pos = self.pos
+        pos += self.velocity * dt
+        self.rect.topleft = round(pos.x), round(pos.y)
+
+    def snapshot(self) -> tuple:
+        """
+        Return the state of the sprite as a tuple of numbers, which restore()
+        sets again. Subclasses append their own values.
+        """
+        return (self.pos.x, self.pos.y, self.rect.x, self.rect.y,
+                self.velocity.x, self.velocity.y)
+
+    def restore(self, values: tuple):
+        """Set the state returned by snapshot()."""
+        self.pos.x, self.pos.y, self.rect.x, self.rect.y, self.velocity.x, self.velocity.y = values[:6]
+
+
+class PooledSprite(MovingSprite):
+    """
+    Base class for sprites that are reused through a class-level Pool instead
+    of being created and killed. Call setup_pool() once before use.
+    """
+    pool = None  # Pool of instances of this class
+    active = None  # The 'active' group of the pool, those on screen to process collision
+    allsprites = None  # Handle to the 'allsprites' group in the main function
+
+    @classmethod
+    def setup_pool(cls, allsprites, size: int = 0, max_size: int = None,
+                   overflow: str = Pool.DROP):
+        """Create the pool of this class and attach it to the 'allsprites' group."""
+        cls.use_pool(Pool(cls, size, max_size, overflow), allsprites)
+
+    @classmethod
+    def use_pool(cls, pool: Pool, allsprites):
+        """Make 'pool' the pool of this class and attach it to the 'allsprites' group."""
+        cls.pool = pool
+        cls.active = pool.active
+        cls.allsprites = allsprites
+
+    @classmethod
+    def acquire(cls):
+        """
+        Pull an instance from the pool and add it to the allsprites group.
+        Return None if the pool is at its cap and drops the request.
+        """
+        sprite = cls.pool.acquire()
+        if sprite is not None:
+            sprite.add(cls.allsprites)
+        return sprite
+
+    def recycle(self):
+        """
+        Remove this instance from the allsprites group and place it back to
+        the pool for later reuse.
+        """
+        self.remove(self.allsprites)
+        self.pool.release(self)
+
+
+class Plane(MovingSprite):
     """
     The plane object that the player controlls.
     """
@@ -49,40 +206,49 @@ class Plane(pygame.sprite.Sprite):
     def key_pressed(self):
         """
         Check if the arrow keys are pressed. If so, store the moving command in
-        'vert' or 'horiz' attributes. The next update() call will move.
+        'vert' or 'horiz' attributes. The next move() call will move.
+        """
+        self.steer(inputs.from_keys(pygame.key.get_pressed()))
+
+    def steer(self, buttons: int):
+        """
+        Store the moving command of the arrow buttons in the mask 'buttons' (see
+        the inputs module) in 'vert' or 'horiz' attributes.
         """
-        keys_pressed = pygame.key.get_pressed()
         self.vert = 0
         self.horiz = 0
-        if keys_pressed[pygame.K_LEFT]:
+        if buttons & inputs.LEFT:
             self.horiz = -self.speed
-        if keys_pressed[pygame.K_RIGHT]:
+        if buttons & inputs.RIGHT:
             self.horiz = self.speed
-        if keys_pressed[pygame.K_UP]:
+        if buttons & inputs.UP:
             self.vert = -self.speed
-        if keys_pressed[pygame.K_DOWN]:
+        if buttons & inputs.DOWN:
             self.vert = self.speed
+        self.velocity.update(self.horiz, self.vert)
 
-    def update(self):
+    def move(self, dt: float = 1):
         """
-        Update the plane position.
+        Update the plane position, keeping it inside the screen.
         """
-        new_rect = self.rect.move((self.horiz, self.vert))
-
-        if not self.area.contains(new_rect):
-            if new_rect.left < self.area.left:
-                new_rect.left = self.area.left
-            elif new_rect.right > self.area.right:
-                new_rect.right = self.area.right
-            elif new_rect.top < self.area.top:
-                new_rect.top = self.area.top
-            elif new_rect.bottom > self.area.bottom:
-                new_rect.bottom = self.area.bottom
-        self.rect = new_rect
+        super().move(dt)
+        if not self.area.contains(self.rect):
+            self.rect.clamp_ip(self.area)
+            self.place()
 
+    def update(self):
         if self.hp > INITIAL_HP:
             self.hp = INITIAL_HP
 
+    def snapshot(self) -> tuple:
+        return super().snapshot() + (self.hp, self.power)
+
+    def restore(self, values: tuple):
+        super().restore(values)
+        self.hp, self.power = values[6:]
+        self.image = self.all_images[self.power]
+        self.horiz, self.vert = int(self.velocity.x), int(self.velocity.y)
+
     def powerup(self):
         """
         The plane power up, changing the 'power' state and the image.
@@ -111,21 +277,20 @@ class Plane(pygame.sprite.Sprite):
         """
         self.rect.centerx = int(self.area.width // 2)
         self.rect.bottom = int(self.area.height * 0.95)
+        self.place()
 
 
-class Missile(pygame.sprite.Sprite):
+class Missile(PooledSprite):
     """
     Missile objects that is fired from player's plane.
     """
-    pool = pygame.sprite.Group()  # Store created missiles to reuse them
-    active = pygame.sprite.Group()  # Store those on screen to process collision
-
     def __init__(self):
         super().__init__()
         self.image, self.rect = main.load_image('bullet.png', colorkey=-1, scale=(5, 20))
         screen = pygame.display.get_surface()
         self.area = screen.get_rect()
         self.speed = 10
+        self.velocity.update(0, -self.speed)
 
     @classmethod
     def position(cls, location: Tuple[int, int], num: int = 1):
@@ -133,31 +298,21 @@ class Missile(pygame.sprite.Sprite):
         Pulls 'num' Missile instance(s) stored in the 'pool' attribute and place it
         above 'location'. Add them to the allsprite and active group.
         """
-        if len(cls.pool) < num:
-            cls.pool.add([Missile() for _ in range(num)])
         x_all = ((-(num-1)/2 + i)*30 for i in range(num))
         for x in x_all:
-            missile = cls.pool.sprites()[0]
-            missile.add(cls.allsprites, cls.active)
-            missile.remove(cls.pool)
+            missile = cls.acquire()
+            if missile is None:
+                return
             missile.rect.bottom = location[1]
             missile.rect.x = int(x + location[0])
-
-    def recycle(self):
-        """
-        Remove this Missile instance from the allsprite and place it back to
-        'pool' attribute for later reuse.
-        """
-        self.add(self.pool)
-        self.remove(self.allsprites, self.active)
+            missile.place()
 
     def update(self):
-        self.rect = self.rect.move(0, -1 * self.speed)
         if self.rect.top < self.area.top:
             self.recycle()
 
 
-class FallingItem(pygame.sprite.Sprite):
+class FallingItem(MovingSprite):
     """
     The base class for all randomly falling items which show up once in a while.
     Only need to create one instances in the main function.
@@ -169,6 +324,7 @@ class FallingItem(pygame.sprite.Sprite):
         screen = pygame.display.get_surface()
         self.area = screen.get_rect()
         self.speed = SCROLLING_SPEED
+        self.velocity.update(0, self.speed)
         self.rect = pygame.Rect
 
     def appear(self, position: int = None):
@@ -178,13 +334,13 @@ class FallingItem(pygame.sprite.Sprite):
         """
         self.rect.top = self.area.top
         if position is None:
-            self.rect.left = random.randrange(self.area.width - 2 * self.rect.width)
+            self.rect.left = rng.randrange(self.area.width - 2 * self.rect.width)
         else:
             self.rect.x = position
+        self.place()
         self.add(self.allsprites)
 
     def update(self):
-        self.rect = self.rect.move(0, 1 * self.speed)
         if self.rect.bottom > self.area.bottom:
             self.kill()
 
@@ -206,6 +362,7 @@ class HpPack(FallingItem):
 class HpBar():
     """
     Use object to track an object's hp attribute value and draw it as a bar.
+    The bar is drawn on its own 'image', again only when the hp changed.
     """
     def __init__(self, tracking_object: Plane):
         self.tracking_object = tracking_object  # Handle to the object to track
@@ -214,19 +371,35 @@ class HpBar():
         self.height = 15
         self.x = 5
         self.y = 620
-
-    def draw(self):
-        """Draw the bar on screen"""
-        pygame.draw.rect(self.screen, (0, 0, 150),
-                         [self.x - 3, self.y - 3, self.width + 6, self.height + 6])
-        pygame.draw.rect(self.screen, (130, 0, 0),
-                         [self.x, self.y, self.width, self.height])
-        pygame.draw.rect(self.screen, (200, 0, 0),
-                         [self.x, self.y, self.tracking_object.hp, self.height])
+        self.image = pygame.Surface(self.rect.size)
+        self.shown_hp = None  # The hp drawn on 'image'
+
+    @property
+    def rect(self) -> pygame.Rect:
+        """The area covered by the bar including its border"""
+        return pygame.Rect(self.x - 3, self.y - 3, self.width + 6, self.height + 6)
+
+    def update(self) -> bool:
+        """Draw the bar on 'image' if the hp changed. Return whether it did."""
+        hp = self.tracking_object.hp
+        if hp == self.shown_hp:
+            return False
+        self.shown_hp = hp
+        self.image.fill((0, 0, 150))
+        pygame.draw.rect(self.image, (130, 0, 0), [3, 3, self.width, self.height])
+        pygame.draw.rect(self.image, (200, 0, 0), [3, 3, hp, self.height])
+        return True
+
+    def draw(self, surface: pygame.Surface = None):
+        """Draw the bar on 'surface', or on screen if not given"""
+        if surface is None:
+            surface = self.screen
+        self.update()
+        surface.blit(self.image, self.rect)
 
 
 # 敵人本身設定
-class Enemy(pygame.sprite.Sprite):
+class Enemy(MovingSprite):
     initial_hp = HP_ENEMY
     all_images = []
 
@@ -238,15 +411,19 @@ class Enemy(pygame.sprite.Sprite):
         self.area = screen.get_rect()
         self.radius = max(self.rect.width, self.rect.height) / 2
         self.speed = 2
-        self.rect.left = random.randrange(self.area.width - self.rect.width)
+        self.rect.left = rng.randrange(self.area.width - self.rect.width)
         self.rect.top = self.area.top
         self.hp = self.initial_hp
         self.missile_number = 0
         self.number_appear = 1
         self.direction = 1
+        if not rng.randrange(2):  # 讓敵人可以隨機左右移動
+            self.direction = -1
         self.frame = 0
         self.fire_count_down = 0
         self.fire_cycle = ENEMY_FIRE_PERIOD
+        self.place()
+        self._steer()
 
     def revival(self): # 血量增後（等級增加）機制
         Enemy.initial_hp += 10
@@ -256,7 +433,7 @@ class Enemy(pygame.sprite.Sprite):
         # Change image to the next
         self.image = self.all_images[self.number_appear - 1]
 
-        self.rect.left = random.randrange(self.area.width - self.rect.width)
+        self.rect.left = rng.randrange(self.area.width - self.rect.width)
         self.rect.top = self.area.top
         if self.number_appear == 4:
             self.speed = 1
@@ -266,27 +443,38 @@ class Enemy(pygame.sprite.Sprite):
             self.fire_cycle = 2*ENEMY_FIRE_PERIOD
         else:
             self.fire_cycle = ENEMY_FIRE_PERIOD
+        self.place()
+        self._steer()
 
-
-    def update(self):
-        if not self.frame % 80:  # 讓敵人可以隨機左右移動
-            if not random.randrange(2):
-                self.direction *= -1
+    def _steer(self):
+        """Set the velocity of the next move from the direction, speed and age."""
         if (self.number_appear == 2) or (self.number_appear == 3):
             if self.frame >= 40 and self.frame < 160:
-                self.rect = self.rect.move(0.5 * self.direction * self.speed, 1 * self.speed)
+                self.velocity.update(0.5 * self.direction * self.speed, 1 * self.speed)
             else:
-                self.rect = self.rect.move(0.5 * self.direction * self.speed, 1.5 * self.speed)
+                self.velocity.update(0.5 * self.direction * self.speed, 1.5 * self.speed)
         else:
-            self.rect = self.rect.move(0.5 * self.direction * self.speed, 1.5 * self.speed)
+            self.velocity.update(0.5 * self.direction * self.speed, 1.5 * self.speed)
+
+    def die(self):
+        ExplosionEnemy.position(self.rect.center)
+        self.kill()
+
+    def snapshot(self) -> tuple:
+        return super().snapshot() + (self.hp, self.number_appear, self.speed, self.direction,
+                                     self.frame, self.missile_number, self.fire_count_down,
+                                     self.fire_cycle)
 
+    def restore(self, values: tuple):
+        super().restore(values)
+        (self.hp, self.number_appear, self.speed, self.direction, self.frame,
+         self.missile_number, self.fire_count_down, self.fire_cycle) = values[6:]
+        self.image = self.all_images[self.number_appear - 1]
+
+    def update(self):
         if not (self.area.right >= self.rect.right and self.rect.left >= self.area.left):
             self.direction *= -1
 
-        if self.hp <= 0:
-            ExplosionEnemy.position(self.rect.center)
-            self.kill()
-
         if self.rect.bottom > self.area.bottom:
             self.kill()
         if self.missile_number > 0 and self.fire_count_down == 0:
@@ -296,49 +484,27 @@ class Enemy(pygame.sprite.Sprite):
         if self.speed == 0 and self.missile_number == 0:
             self.speed = 2
         self.frame += 1
+        if not self.frame % 80:  # 讓敵人可以隨機左右移動
+            if not rng.randrange(2):
+                self.direction *= -1
+        self._steer()
 
 
     def fire(self): # 發射砲彈的方式
         if not self.frame % self.fire_cycle:
-            if self.number_appear == 0:
-                self.missile_number = 5
-            elif self.number_appear == 4:
-                self.missile_number = 5
-            else:
-                self.missile_number = 3
+            self.missile_number = patterns.ENEMY_PATTERNS[self.number_appear].shots
             self._fire()
 
     def _fire(self):
         if self.missile_number > 0:
-            if self.number_appear == 0:
-                n = 6
-                for i in range(n):
-                    vector = (math.cos(2*math.pi*i/n),
-                              math.sin(2*math.pi*i/n))
-                    EnemyMissile.position([int(round(x + dx*self.radius)) for x, dx in zip(self.rect.center, vector)],
-                                          direction=vector)
-
-                self.fire_count_down = int(0.5*FIRE_WAIT)
-            elif self.number_appear == 4:
-                n = 6
-                for i in range(n):
-                    vector = (math.cos(2*math.pi*i/n),
-                              math.sin(2*math.pi*i/n))
-                    vector2 = (math.cos(2*math.pi*(i/n) + self.missile_number*2/(n+1)),
-                               math.sin(2*math.pi*(i/n) + self.missile_number*2/(n+1)))
-                    position = [int(round(x + dx*self.radius)) for x, dx in zip(self.rect.center, vector2)]
-                    EnemyMissile.position(position, direction=vector)
-
-                self.fire_count_down = int(0.5*FIRE_WAIT)
-
-            else:
-                EnemyMissile.position(self.rect.midbottom)
-                self.fire_count_down = FIRE_WAIT
+            pattern = patterns.ENEMY_PATTERNS[self.number_appear]
+            EnemyMissile.volley(self, pattern.table[1][self.missile_number])
+            self.fire_count_down = int(pattern.wait*FIRE_WAIT)
             self.missile_number -= 1
 
 
 # 魔王本身設定
-class Boss(pygame.sprite.Sprite):
+class Boss(MovingSprite):
     initial_hp = HP_BOSS
     all_images = []
     def __init__(self):
@@ -349,7 +515,7 @@ class Boss(pygame.sprite.Sprite):
         self.area = screen.get_rect()
         self.radius = max(self.rect.width, self.rect.height) / 2
         self.speed = 1.5
-        self.rect.left = random.randrange(self.area.width - self.rect.width)
+        self.rect.left = rng.randrange(self.area.width - self.rect.width)
         self.rect.top = self.area.top
         self.hp = HP_BOSS
         self.direction = 1
@@ -357,6 +523,8 @@ class Boss(pygame.sprite.Sprite):
         self.missile_number = 0
         self.fire_count_down = 0
         self.firing_dir = 1
+        self.place()
+        self.velocity.update(self.direction * self.speed, 0)
    
     def revival(self): # 血量增厚（等級提升）機制
         Boss.initial_hp += 80
@@ -367,13 +535,12 @@ class Boss(pygame.sprite.Sprite):
         self.image = self.all_images[self.number_appear % 5 -1]
         self.rect = self.image.get_rect()
 
-        self.rect.left = random.randrange(self.area.width - self.rect.width)
+        self.rect.left = rng.randrange(self.area.width - self.rect.width)
         self.rect.top = self.area.top
+        self.place()
 
 
     def update(self): # 移動方式
-        self.rect = self.rect.move(self.direction * self.speed, 0)
-
         if not (self.area.right >= self.rect.right and self.rect.left >= self.area.left):
             self.direction *= -1
         if self.missile_number > 0 and self.fire_count_down == 0:
@@ -382,52 +549,43 @@ class Boss(pygame.sprite.Sprite):
             self.fire_count_down -= 1
         if self.speed == 0 and self.missile_number == 0:
             self.speed = 1.5
+        self.velocity.update(self.direction * self.speed, 0)
 
     def die(self): # 製造爆炸畫面
         ExplosionBoss.position(self.rect.center)
         self.kill()
 
+    def snapshot(self) -> tuple:
+        return super().snapshot() + (self.hp, self.number_appear, self.speed, self.direction,
+                                     self.missile_number, self.fire_count_down, self.firing_dir)
+
+    def restore(self, values: tuple):
+        (self.hp, self.number_appear, self.speed, self.direction,
+         self.missile_number, self.fire_count_down, self.firing_dir) = values[6:]
+        self.image = self.all_images[self.number_appear % 5 - 1]
+        self.rect.size = self.image.get_size()
+        super().restore(values)
+
     def fire(self): # 發射砲彈
         if self.missile_number > 0:
             return
-        if self.number_appear == 1 or self.number_appear == 4:
+        pattern = patterns.BOSS_PATTERNS[self.number_appear]
+        if pattern.mirrored:
             self.firing_dir *= -1
-            self.missile_number = 20
-            # self.speed = 0
-        elif self.number_appear == 2 or self.number_appear == 0:
-            self.firing_dir *= -1
-            self.missile_number = 10
-        else:
-            self.missile_number = 1
+        self.missile_number = pattern.shots
         self._fire()
 
     def _fire(self):
-        if self.number_appear == 1 or self.number_appear == 4:
-            vector = (self.firing_dir*math.cos(math.pi*(0.8*self.missile_number/20 + 0.1)),
-                      math.sin(math.pi*(0.8*self.missile_number/20 + 0.1)))
-            EnemyMissile.position(self.rect.midbottom,
-                                  direction=vector)
-
-            self.fire_count_down = int(0.3*FIRE_WAIT)
-        elif self.number_appear == 2 or self.number_appear == 0:
-            vector = (self.firing_dir*math.cos(math.pi*(0.8*self.missile_number/10 + 0.1)),
-                      math.sin(math.pi*(0.4*self.missile_number/10 + 0.1)))
-            EnemyMissile.position(self.rect.midbottom, 2,
-                                  direction=vector)
-            self.fire_count_down = int(0.8*FIRE_WAIT)
-        else:
-            vector = (math.cos(2*math.pi*1/6), math.sin(2*math.pi*1/6))
-            vector2 = (math.cos(2*math.pi*2/6), math.sin(2*math.pi*2/6))
-            EnemyMissile.position(self.rect.midbottom, 3)
-            EnemyMissile.position(self.rect.midbottom, 3, direction=vector)
-            EnemyMissile.position(self.rect.midbottom, 3, direction=vector2)
+        pattern = patterns.BOSS_PATTERNS[self.number_appear]
+        EnemyMissile.volley(self, pattern.table[self.firing_dir][self.missile_number])
+        if pattern.wait is not None:
+            self.fire_count_down = int(pattern.wait*FIRE_WAIT)
         self.missile_number -= 1
 
 
 # 敵人射出的飛彈
-class EnemyMissile(pygame.sprite.Sprite):
-    pool = pygame.sprite.Group()
-    active = pygame.sprite.Group()
+class EnemyMissile(PooledSprite):
+    field = None  # A bullets.BulletField that replaces the pool when set
 
     def __init__(self):
         super().__init__()
@@ -442,40 +600,55 @@ class EnemyMissile(pygame.sprite.Sprite):
         """
         Pulls 'num' Missile instance(s) stored in the 'pool' attribute and place it
         above 'location'. Add them to the allsprite and active group.
+        If 'field' is set, the missiles are spawned into it instead.
         """
-        if len(cls.pool) < num:
-            cls.pool.add([EnemyMissile() for _ in range(num)])
+        if cls.field is not None:
+            cls.field.spawn(location, num, direction)
+            return
         x_all = ((-(num-1)/2 + i)*30 for i in range(num))
         for x in x_all:
-            missile = cls.pool.sprites()[0]
-            missile.add(cls.allsprites, cls.active)
-            missile.remove(cls.pool)
+            missile = cls.acquire()
+            if missile is None:
+                return
             missile.rect.bottom = location[1]
             missile.rect.centerx = int(x + location[0])
             missile.direction = direction
+            missile.place()
+            missile.velocity.update(direction)
+            missile.velocity *= missile.speed
 
-    def recycle(self): # 回收到pool裡重複再利用
-        """
-        Remove this Missile instance from the allsprite and place it back to
-        'pool' attribute for later reuse.
-        """
-        self.add(self.pool)
-        self.remove(self.allsprites, self.active)
+    @classmethod
+    def volley(cls, shooter: pygame.sprite.Sprite, shots: Sequence['patterns.Shot']):
+        """Fire the 'shots' of a volley of a patterns.Pattern from 'shooter'."""
+        rect = shooter.rect
+        for offset, num, direction in shots:
+            if offset is None:
+                cls.position(rect.midbottom, num, direction)
+            else:
+                x, y = rect.center
+                cls.position((int(round(x + offset[0]*shooter.radius)),
+                              int(round(y + offset[1]*shooter.radius))), num, direction)
+
+    @classmethod
+    def population(cls) -> int:
+        """Return the number of enemy missiles on screen, in the pool or the field."""
+        count = len(cls.active) if cls.active is not None else 0
+        if cls.field is not None:
+            count += len(cls.field)
+        return count
 
     def update(self):
-        self.rect = self.rect.move([int(round(d*self.speed)) for d in self.direction])
-        if self.rect.bottom > self.area.bottom:
+        # Recycle once it has left the screen through any edge. The margin is
+        # read every time, so that pooled missiles follow a change of it
+        if not self.area.inflate(2 * OFFSCREEN_MARGIN, 2 * OFFSCREEN_MARGIN).colliderect(self.rect):
             self.recycle()
 
 
 # 小兵死掉時的爆炸畫面
-class ExplosionEnemy(pygame.sprite.Sprite):
+class ExplosionEnemy(PooledSprite):
     """
     The explosion image that will show up when a normal enemy dies.
     """
-    pool = pygame.sprite.Group()
-    active = pygame.sprite.Group()
-
     def __init__(self):
         super().__init__()
         self.explode_image, _ = main.load_image('enemy_ex.png', colorkey=-1, scale=(32, 34))
@@ -484,6 +657,7 @@ class ExplosionEnemy(pygame.sprite.Sprite):
         screen = pygame.display.get_surface()
         self.area = screen.get_rect()
         self.speed = 2
+        self.velocity.update(0, 2 * self.speed)
         self.remaining_time = 0
         self.wait = 7
 
@@ -493,41 +667,36 @@ class ExplosionEnemy(pygame.sprite.Sprite):
         Pulls a Explosion instance stored in the 'pool' attribute and place its
         center at 'location'. Add them to the allsprite and active group.
         """
-        if len(cls.pool) < 1:
-            cls.pool.add(cls())
-        explosion = cls.pool.sprites()[0]
-        explosion.add(cls.allsprites, cls.active)
-        explosion.remove(cls.pool)
+        explosion = cls.acquire()
+        if explosion is None:
+            return
         explosion.rect.center = location
+        explosion.place()
         explosion.image = explosion.explode_image
         explosion.remaining_time = explosion.wait
 
-
-    def recycle(self):
-        """
-        Remove this Explosion instance from the allsprite and place it back to
-        'pool' attribute for later reuse.
-        """
-        self.add(self.pool)
-        self.remove(self.allsprites, self.active)
-
     def update(self):
         if not self.remaining_time:
             self.recycle()
             return
         self.remaining_time -= 1
-        self.rect = self.rect.move(0, 2 * self.speed) # 小兵移動速度
         if self.remaining_time == 1:
             self.image = self.ash_image
 
+    def snapshot(self) -> tuple:
+        return super().snapshot() + (self.remaining_time,)
+
+    def restore(self, values: tuple):
+        super().restore(values)
+        self.remaining_time = values[6]
+        # The ash is shown from the last two frames on
+        self.image = self.ash_image if self.remaining_time <= 1 else self.explode_image
+
 # Boss死掉時的爆炸畫面
-class ExplosionBoss(pygame.sprite.Sprite):
+class ExplosionBoss(PooledSprite):
     """
     The explosion image that will show up when a boss dies.
     """
-    pool = pygame.sprite.Group()
-    active = pygame.sprite.Group()
-
     def __init__(self):
         super().__init__()
         self.explode_image, _ = main.load_image('enemy_ex.png', colorkey=-1, scale=(96, 102))
@@ -536,6 +705,7 @@ class ExplosionBoss(pygame.sprite.Sprite):
         screen = pygame.display.get_surface()
         self.area = screen.get_rect()
         self.speed = 2
+        self.velocity.update(0, 2 * self.speed)
         self.remaining_time = 0
         self.wait = 10
 
@@ -545,42 +715,47 @@ class ExplosionBoss(pygame.sprite.Sprite):
         Pulls a Explosion instance stored in the 'pool' attribute and place its
         center at 'location'. Add them to the allsprite and active group.
         """
-        if len(cls.pool) < 1:
-            cls.pool.add(cls())
-        explosion = cls.pool.sprites()[0]
-        explosion.add(cls.allsprites, cls.active)
-        explosion.remove(cls.pool)
+        explosion = cls.acquire()
+        if explosion is None:
+            return
         explosion.rect.center = location
+        explosion.place()
         explosion.image = explosion.explode_image
         explosion.remaining_time = explosion.wait
 
-    def recycle(self):
-        """
-        Remove this Explosion instance from the allsprite and place it back to
-        'pool' attribute for later reuse.
-        """
-        self.add(self.pool)
-        self.remove(self.allsprites, self.active)
-
     def update(self):
         if not self.remaining_time:
             self.recycle()
             return
         self.remaining_time -= 1
-        self.rect = self.rect.move(0, 2 * self.speed) # Boss移動速度
         if self.remaining_time == 1:
             self.image = self.ash_image
 
+    def snapshot(self) -> tuple:
+        return super().snapshot() + (self.remaining_time,)
+
+    def restore(self, values: tuple):
+        super().restore(values)
+        self.remaining_time = values[6]
+        # The ash is shown from the last two frames on
+        self.image = self.ash_image if self.remaining_time <= 1 else self.explode_image
+
 
 class Button(object):
+    """
+    A button that follows the mouse through the events given to handle(),
+    shown pushed down while the mouse is over it. It is 'pressed' once the
+    left mouse button is down over it.
+    """
     def __init__(self, image1, image2, position):
         self.imageUp, _ = main.load_image(image1, colorkey=-1, scale=(272, 81))
         self.imageDown, _ = main.load_image(image2, colorkey=-1, scale=(272, 81))
         self.position = position
         self.pressed = False
+        self.over = self.isOver()
 
-    def isOver(self):
-        point_x, point_y = pygame.mouse.get_pos()
+    def isOver(self, point: Tuple[int, int] = None):
+        point_x, point_y = point if point is not None else pygame.mouse.get_pos()
         x, y = self. position
         w, h = self.imageUp.get_size()
 
@@ -588,13 +763,27 @@ class Button(object):
         in_y = y - h/2 < point_y < y + h/2
         return in_x and in_y
 
+    def handle(self, event: pygame.event.Event) -> bool:
+        """Follow a mouse 'event' and return whether the button looks different now."""
+        if event.type == pygame.MOUSEMOTION:
+            over = self.isOver(event.pos)
+            if over and event.buttons[0]:
+                self.pressed = True
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            over = self.isOver(event.pos)
+            if over:
+                self.pressed = True
+        else:
+            return False
+        changed = over != self.over
+        self.over = over
+        return changed
+
     def render(self, screen):
         w, h = self.imageUp.get_size()
         x, y = self.position
 
-        if self.isOver():
+        if self.over:
             screen.blit(self.imageDown, (int(x-w/2), int(y-h/2)))
-            if pygame.mouse.get_pressed()[0]:
-                self.pressed = True
         else:
             screen.blit(self.imageUp, (int(x-w/2), int(y-h/2)))
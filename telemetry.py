@@ -0,0 +1,301 @@
+"""
+This module logs gameplay events, such as spawns, hits, kills, pickups,
+boss deaths and frame times, to a compressed file without stalling the
+game. log() only packs the event into a ring buffer allocated up front. A
+background thread takes the events out in batches and compresses and writes
+them. If the buffer is full, the event is dropped and counted, and the
+count is written to the log as a DROPPED event.
+
+    python telemetry.py events.log.gz   # Summarize a log
+    python telemetry.py --overhead      # Measure the cost of logging
+
+A log is a gzip file holding a header and then the events, one RECORD
+each. Every batch is flushed on its own, so the events written before a
+crash can still be read.
+"""
+import atexit
+import threading
+import time
+import struct
+from pathlib import Path
+from typing import Iterator, List, NamedTuple
+import zlib
+
+
+MAGIC = b'PBCT'
+VERSION = 1
+HEADER = struct.Struct('<4sB')  # Magic, version
+# Kind, subject, session, frame, x, y, value
+RECORD = struct.Struct('<BBIIhhd')
+
+# Kinds of events. The subject is the letter of game.SPRITE_KINDS of the
+# sprite the event is about, and x, y its center.
+FRAME = 0  # A frame was drawn or a server tick was played, value: its time in ms
+GAME_START = 1  # value: seed
+GAME_OVER = 2  # value: score
+SPAWN = 3  # An enemy or boss appeared
+HIT = 4  # The plane was hit by the subject, value: HP left
+KILL = 5  # An enemy was shot down, value: score
+BOSS_DEATH = 6  # value: number of the boss
+PICKUP = 7  # The plane took a powerup or HP pack, value: HP
+DROPPED = 8  # Events dropped since the last batch because the buffer was full, value: count
+KIND_NAMES = ('frame', 'game_start', 'game_over', 'spawn', 'hit', 'kill', 'boss_death',
+              'pickup', 'dropped')
+
+CAPACITY = 1 << 16  # Events the ring buffer holds
+INTERVAL = 0.5  # Seconds between batches, sooner if the buffer is half full
+LEVEL = 1  # zlib compression level, higher ones take 4 times longer for 5% less
+
+
+class Event(NamedTuple):
+    """An event read back from a log."""
+    kind: int
+    subject: str
+    session: int
+    frame: int
+    x: int
+    y: int
+    value: float
+
+
+class Telemetry:
+    """
+    Log events to the file 'path' through a ring buffer of 'capacity'
+    events, emptied by a background thread every 'interval' seconds.
+
+    log() is meant to be called from a single thread, the game loop. It
+    only writes the head of the buffer and the writer thread only its
+    tail, so they share no lock. close() writes what is left, and is also
+    called at exit.
+    """
+    def __init__(self, path, capacity: int = CAPACITY, interval: float = INTERVAL,
+                 level: int = LEVEL):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.head = 0  # Events logged, the next one goes to slot head % capacity
+        self.tail = 0  # Events taken out by the writer
+        self.dropped = 0  # Events dropped because the buffer was full
+        self.dropped_written = 0  # Dropped events counted in the file so far
+        self.stats = {'written': 0, 'batches': 0, 'raw_bytes': 0, 'compressed_bytes': 0,
+                      'write_seconds': 0.0, 'lost': 0}
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.file = open(self.path, 'wb')
+        self.file.write(self.compressor.compress(HEADER.pack(MAGIC, VERSION)))
+        self.failed = False
+        self.closing = False
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='Telemetry', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, kind: int, subject: str = '', session: int = 0, frame: int = 0,
+            x: int = 0, y: int = 0, value: float = 0.0):
+        """Add an event to the buffer, or count it as dropped if the buffer is full."""
+        head = self.head
+        pending = head - self.tail
+        if pending >= self.capacity:
+            self.dropped += 1
+            return
+        RECORD.pack_into(self.buffer, head % self.capacity * RECORD.size, kind,
+                         ord(subject) if subject else 0, session, frame, x, y, value)
+        self.head = head + 1
+        if pending == self.capacity // 2:
+            self.wake.set()
+
+    def _take(self) -> bytes:
+        """Copy the events logged since the last call out of the buffer."""
+        head = self.head
+        tail = self.tail
+        if head == tail:
+            return b''
+        size = RECORD.size
+        start = tail % self.capacity * size
+        end = head % self.capacity * size
+        if end > start:
+            data = bytes(self.buffer[start:end])
+        else:
+            data = bytes(self.buffer[start:]) + bytes(self.buffer[:end])
+        # Only now may log() write over the slots
+        self.tail = head
+        return data
+
+    def _write_batch(self):
+        data = self._take()
+        dropped = self.dropped
+        if dropped != self.dropped_written:
+            data += RECORD.pack(DROPPED, 0, 0, 0, 0, 0, dropped - self.dropped_written)
+            self.dropped_written = dropped
+        if not data:
+            return
+        stats = self.stats
+        if self.failed:
+            stats['lost'] += len(data) // RECORD.size
+            return
+        start = time.thread_time()
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        try:
+            self.file.write(compressed)
+            self.file.flush()
+        except OSError as error:
+            print('Warning: cannot write telemetry to %s: %s' % (self.path, error))
+            self.failed = True
+            stats['lost'] += len(data) // RECORD.size
+            return
+        stats['write_seconds'] += time.thread_time() - start
+        stats['written'] += len(data) // RECORD.size
+        stats['batches'] += 1
+        stats['raw_bytes'] += len(data)
+        stats['compressed_bytes'] += len(compressed)
+
+    def _run(self):
+        while not self.closing:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self._write_batch()
+
+    def close(self):
+        """Write the events left and close the file. Events logged after this are dropped."""
+        if self.closing:
+            return
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        self._write_batch()
+        try:
+            if not self.failed:
+                self.file.write(self.compressor.flush())
+            self.file.close()
+        except OSError as error:
+            print('Warning: cannot write telemetry to %s: %s' % (self.path, error))
+        atexit.unregister(self.close)
+
+    def line(self) -> str:
+        """Return a line of the events written, dropped and the compression ratio."""
+        stats = self.stats
+        return ('telemetry: %d events in %d batches, %d dropped, %d lost, %.1fx compression, '
+                '%.1f ms writing'
+                % (stats['written'], stats['batches'], self.dropped, stats['lost'],
+                   stats['raw_bytes'] / stats['compressed_bytes']
+                   if stats['compressed_bytes'] else 0.0,
+                   1000 * stats['write_seconds']))
+
+
+def read(path) -> Iterator[Event]:
+    """
+    Yield the events of the log at 'path'. A log cut short, e.g. by a
+    crash, is read up to its last whole batch.
+    """
+    with open(path, 'rb') as file:
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(file.read())
+    if len(data) < HEADER.size or HEADER.unpack_from(data) != (MAGIC, VERSION):
+        raise ValueError('Not a telemetry log of this version')
+    end = HEADER.size + (len(data) - HEADER.size) // RECORD.size * RECORD.size
+    for kind, subject, session, frame, x, y, value in RECORD.iter_unpack(data[HEADER.size:end]):
+        yield Event(kind, chr(subject) if subject else '', session, frame, x, y, value)
+
+
+def summary(events) -> List[str]:
+    """Return lines of the count of each kind of event and the frame time percentiles."""
+    counts = [0] * len(KIND_NAMES)
+    frame_times = []
+    dropped = 0
+    sessions = set()
+    for event in events:
+        counts[event.kind] += 1
+        sessions.add(event.session)
+        if event.kind == FRAME:
+            frame_times.append(event.value)
+        elif event.kind == DROPPED:
+            dropped += int(event.value)
+    lines = ['%d events from %d sessions, %d dropped' % (sum(counts), len(sessions), dropped)]
+    lines.extend('%-12s %d' % (name, count) for name, count in zip(KIND_NAMES, counts) if count)
+    if frame_times:
+        frame_times.sort()
+        lines.append('frame ms: mean %.2f, p50 %.2f, p95 %.2f, max %.2f'
+                     % (sum(frame_times) / len(frame_times),
+                        frame_times[len(frame_times) // 2],
+                        frame_times[min(len(frame_times) - 1, int(0.95 * len(frame_times)))],
+                        frame_times[-1]))
+    return lines
+
+
+def measure_overhead(frames: int = 3000, seed: int = 0, repeats: int = 5) -> List[str]:
+    """
+    Play and draw 'frames' frames of games with the DodgeBot, from seed
+    'seed', with telemetry, and return lines of the time logging adds to a
+    frame: the events logged times the cost of log(), measured on its own,
+    plus the CPU time of the writer thread. The frames are also timed
+    without telemetry, 'repeats' times each way, which should agree within
+    the noise of the runs.
+    """
+    import tempfile
+    import game
+    import inputs
+    import main
+
+    screen = game.setup_headless()
+    state, renderer = main.create_view(screen)
+    clock = time.perf_counter
+    times = {False: [], True: []}
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'events.log.gz'
+        for _ in range(repeats):
+            for logging in (False, True):
+                log = Telemetry(path) if logging else None
+                state.telemetry = log
+                state.reset(seed)
+                bot = inputs.DodgeBot(state)
+                start = last = clock()
+                for _ in range(frames):
+                    if not state.step(bot()):
+                        state.reset(state.seed + 1)
+                    renderer.draw_frame()
+                    if log is not None:
+                        now = clock()
+                        log.log(FRAME, frame=state.frame, value=1000 * (now - last))
+                        last = now
+                times[logging].append((clock() - start) / frames)
+                if log is not None:
+                    log.close()
+                    events = log.stats['written']
+                    write_seconds = log.stats['write_seconds']
+
+        # The cost of log() for events like those of the game
+        log = Telemetry(path)
+        calls = min(100000, log.capacity)
+        start = clock()
+        for i in range(calls):
+            log.log(HIT, 'n', 1, i, 240, 600, 150.0)
+        event_seconds = (clock() - start) / calls
+        log.close()
+    state.telemetry = None
+
+    without, with_log = min(times[False]), min(times[True])
+    added = (events * event_seconds + write_seconds) / frames
+    return ['%.2f events per frame, %.2f us per event, %.1f ms writing in all'
+            % (events / frames, 1e6 * event_seconds, 1000 * write_seconds),
+            'Overhead: %.4f ms per frame of %.3f ms (%.2f%%)'
+            % (1000 * added, 1000 * without, 100 * added / without),
+            'Frame time: %.3f ms without telemetry, %.3f ms with it (%+.1f%%, best of %d)'
+            % (1000 * without, 1000 * with_log, 100 * (with_log - without) / without,
+               repeats)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize a telemetry log')
+    parser.add_argument('path', nargs='?', help='log to summarize')
+    parser.add_argument('--overhead', action='store_true',
+                        help='measure the time logging adds to a frame instead')
+    parser.add_argument('--frames', type=int, default=3000, help='frames of the measurement')
+    args = parser.parse_args()
+
+    if args.overhead:
+        print('\n'.join(measure_overhead(args.frames)))
+    elif args.path:
+        print('\n'.join(summary(read(args.path))))
+    else:
+        parser.error('give a log to summarize or --overhead')
@@ -0,0 +1,21 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pytest  # noqa: E402
+import env  # noqa: E402
+
+
+def test_step_rejects_wrong_number_of_actions():
+    environment = env.VectorEnv(3, size=(21, 28))
+    environment.reset(seed=0)
+    with pytest.raises(ValueError):
+        environment.step([0, 0])
+    with pytest.raises(ValueError):
+        environment.step([0, 0, 0, 0])
+    # Nothing was played by the rejected steps
+    assert [state.frame for state in environment.states] == [0, 0, 0]
+    observations, rewards, dones, infos = environment.step([0, 1, 2])
+    assert observations.shape == (3, 28, 21, 3)
+    assert len(infos) == 3